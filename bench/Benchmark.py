@@ -0,0 +1,206 @@
+"""
+Benchmarks the assistant end to end without a sound card or the network. WAV fixtures are
+played through a file-backed Recorder source, and the OpenAI clients are pointed at a local
+fake server with a configurable latency and token rate. For every combination of document
+size and utterance length it reports the latency of each stage and end to end, the
+throughput, and the peak memory traced by tracemalloc.
+
+Usage: python bench/Benchmark.py [--doc-sizes 10000 100000] [--utterance-secs 1 3] [--json results.jsonl]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from langchain_openai import OpenAIEmbeddings
+
+from ApiClient import ApiClient
+from FakeOpenAIServer import FakeOpenAIServer
+from Fixtures import write_document, write_utterances
+from LLMQuery import LLMQuery
+from Metrics import metrics
+from Recorder import FileSource, Recorder
+from SpeechToText import AudioTranscriber
+from Transcript import TranscriptWindow
+
+
+STAGES = ["record", "transcribe", "first suggestion", "suggestions", "end to end"]
+
+
+def build_query(transcript) -> str:
+    return f"""
+Your role is a caller making a call to a company, the purpose is to sell a product/service to the other party.
+You can only use stats and figures that are given in the context provided.
+
+Here is the transcript between the caller and callee:
+{transcript.text()}
+
+Please suggest up to 3 possible sentences that could help increase the chances of this call going well, do not number these sentences.
+"""
+
+
+def run_case(llm: LLMQuery, file_paths: list[str], wav_path: str, samplerate: int, output_dir: str) -> dict[str, list[float]]:
+    """
+    Play a WAV fixture through a recorder and run every utterance in it through the stages
+    of the assistant in turn, timing each one.
+
+    :return: The seconds taken by each stage for each utterance.
+    """
+    recorder = Recorder(mode="speaker", output_dir=output_dir, samplerate=samplerate,
+                        source=FileSource(wav_path, samplerate))
+    transcriber = AudioTranscriber(llm.api_client)
+    transcript = TranscriptWindow(token_budget=1000, count_tokens=llm.token_counter.count)
+
+    timings: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    while True:
+        start = time.perf_counter()
+        try:
+            audio = recorder.record()
+        except EOFError:
+            break
+        recorded = time.perf_counter()
+
+        transcript.add("CALLEE", transcriber.transcribe(audio))
+        transcribed = time.perf_counter()
+
+        first = None
+        for _ in llm.stream_query(file_paths, [], build_query(transcript)):
+            if first is None:
+                first = time.perf_counter()
+        done = time.perf_counter()
+
+        timings["record"].append(recorded - start)
+        timings["transcribe"].append(transcribed - recorded)
+        timings["first suggestion"].append((first or done) - transcribed)
+        timings["suggestions"].append(done - transcribed)
+        timings["end to end"].append(done - start)
+    return timings
+
+
+def summarise_timings(timings: list[float]) -> dict[str, float]:
+    if not timings:
+        return {"mean": float("nan"), "p50": float("nan"), "p95": float("nan")}
+    milliseconds = np.array(timings) * 1000
+    return {
+        "mean": float(milliseconds.mean()),
+        "p50": float(np.percentile(milliseconds, 50)),
+        "p95": float(np.percentile(milliseconds, 95)),
+    }
+
+
+def print_result(result: dict):
+    print(
+        f"\ndocuments={result['doc_chars']} chars, utterances={result['utterance_secs']} secs x {result['utterances']}: "
+        f"indexed in {result['index_ms']:.0f} ms, {result['throughput']:.2f} utterances/sec, "
+        f"{result['realtime_factor']:.1f}x realtime, peak memory {result['peak_mb']:.1f} MB"
+    )
+    print(f"  {'stage (ms)':<18}{'mean':>10}{'p50':>10}{'p95':>10}")
+    for stage in STAGES:
+        stats = result["stages"][stage]
+        print(f"  {stage:<18}{stats['mean']:>10.1f}{stats['p50']:>10.1f}{stats['p95']:>10.1f}")
+    print(f"  {'span (ms)':<18}{'count':>10}{'mean':>10}{'max':>10}")
+    for name, stats in result["spans"].items():
+        print(f"  {name:<18}{stats['count']:>10}{stats['mean'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the assistant offline against a fake OpenAI API.")
+    parser.add_argument("--doc-sizes", type=int, nargs="+", default=[10_000, 100_000],
+                        help="The sizes of the documents to index, in characters.")
+    parser.add_argument("--utterance-secs", type=float, nargs="+", default=[1.0, 3.0],
+                        help="The lengths of the utterances, in seconds.")
+    parser.add_argument("--utterances", type=int, default=5, help="The number of utterances in each case.")
+    parser.add_argument("--samplerate", type=int, default=16000)
+    parser.add_argument("--latency", type=float, default=0.2, help="The fake API's latency in seconds.")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="The fake API's completion tokens per second.")
+    parser.add_argument("--retrieval-mode", default="hybrid")
+    parser.add_argument("--vector-backend", default="faiss", help="The vector store, faiss or memmap.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracing memory, which slows everything down.")
+    parser.add_argument("--json", help="Append the results to this file, one JSON object per case.")
+    parser.add_argument("--verbose", action="store_true", help="Show the assistant's own output.")
+    args = parser.parse_args(argv)
+
+    metrics.enable()
+    workspace = tempfile.mkdtemp(prefix="bench_")
+    results = []
+    with FakeOpenAIServer(latency=args.latency, token_rate=args.token_rate) as server:
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = server.url
+        os.environ["OPENAI_API_BASE"] = server.url
+        cwd = os.getcwd()
+        try:
+            for doc_chars in args.doc_sizes:
+                case_dir = os.path.join(workspace, f"docs_{doc_chars}")
+                os.makedirs(case_dir)
+                os.chdir(case_dir)  # the index and caches are written relative to the working directory
+                file_paths = [write_document(os.path.join("doc", "pricing.txt"), doc_chars)]
+
+                output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with output:
+                    if not args.no_memory:
+                        tracemalloc.start()
+
+                    api_client = ApiClient()
+                    embeddings = OpenAIEmbeddings(api_key="bench", check_embedding_ctx_length=False,
+                                                  **api_client.langchain_kwargs())
+                    llm = LLMQuery(retrieval_mode=args.retrieval_mode, embeddings=embeddings, api_client=api_client,
+                                   vector_backend=args.vector_backend)
+                    start = time.perf_counter()
+                    llm.index.refresh(file_paths)
+                    index_secs = time.perf_counter() - start
+
+                    for utterance_secs in args.utterance_secs:
+                        wav_path = write_utterances(os.path.join("wav", f"{utterance_secs}.wav"), args.samplerate,
+                                                    args.utterances, utterance_secs)
+                        if not args.no_memory:
+                            tracemalloc.reset_peak()
+                        server.requests.clear()
+                        metrics.reset()
+
+                        start = time.perf_counter()
+                        timings = run_case(llm, file_paths, wav_path, args.samplerate, output_dir="rec")
+                        elapsed = time.perf_counter() - start
+
+                        results.append({
+                            "doc_chars": doc_chars,
+                            "utterance_secs": utterance_secs,
+                            "vector_backend": args.vector_backend,
+                            "utterances": len(timings["end to end"]),
+                            "index_ms": index_secs * 1000,
+                            "throughput": len(timings["end to end"]) / elapsed,
+                            "realtime_factor": len(timings["end to end"]) * utterance_secs / elapsed,
+                            "peak_mb": tracemalloc.get_traced_memory()[1] / 2**20 if not args.no_memory else float("nan"),
+                            "requests": dict(server.requests),
+                            "stages": {stage: summarise_timings(timings[stage]) for stage in STAGES},
+                            "spans": metrics.summary(),
+                        })
+
+                    llm.stop()
+                    api_client.close()
+                    if not args.no_memory:
+                        tracemalloc.stop()
+
+                for result in results[-len(args.utterance_secs):]:
+                    print_result(result)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "a") as fw:
+            for result in results:
+                fw.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class FakeOpenAIServer:
+    """
+    A local stand-in for the parts of the OpenAI API the assistant uses: completions (plain
+    and streamed), embeddings and audio transcriptions. Responses are deterministic, and
+    arrive after a configurable latency, with completion tokens produced at a configurable
+    rate, so the rest of the system can be benchmarked without the network.
+
+    Point the clients at it by setting OPENAI_BASE_URL (and OPENAI_API_BASE) to its url.
+    """
+
+    SUGGESTIONS = [
+        "Our Zephyr plan costs 2,400 per seat and pays for itself within 3.5 months.",
+        "Teams like yours usually cut onboarding time by 40 percent in the first quarter.",
+        "I can send over the case study from a company of a similar size this afternoon.",
+    ]
+    TRANSCRIPTIONS = [
+        "We are looking at a few options for the next quarter.",
+        "Honestly the price seems high compared to what we pay now.",
+        "How long would it take to get the whole team onboarded?",
+        "We would need it to work with our existing CRM.",
+    ]
+
+    def __init__(self, latency: float = 0.2, token_rate: float = 50.0, completion_tokens: int = 40,
+                 embedding_dim: int = 256, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param latency: The number of seconds before each response starts.
+        :param token_rate: The number of completion tokens generated per second.
+        :param completion_tokens: The number of tokens in each completion.
+        :param embedding_dim: The dimension of the embeddings.
+        :param host: The host to listen on.
+        :param port: The port to listen on, 0 for any free port.
+        """
+        self.latency = latency
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.embedding_dim = embedding_dim
+        self.requests: Counter[str] = Counter()
+
+        self._transcriptions = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def completion_tokens_text(self) -> list[str]:
+        """
+        The tokens of every completion: the canned suggestions one per line, cut or repeated
+        to completion_tokens tokens.
+        """
+        words = re.findall(r"\S+\s*", "\n".join(self.SUGGESTIONS) + "\n")
+        return [words[i % len(words)] for i in range(self.completion_tokens)]
+
+    def embed(self, item) -> np.ndarray:
+        """
+        A deterministic unit vector for a text or list of token ids.
+        """
+        seed = hashlib.sha256(json.dumps(item).encode("utf-8")).digest()
+        vector = np.random.default_rng(int.from_bytes(seed[:8], "little")).standard_normal(self.embedding_dim)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    def next_transcription(self) -> str:
+        with self._lock:
+            text = self.TRANSCRIPTIONS[self._transcriptions % len(self.TRANSCRIPTIONS)]
+            self._transcriptions += 1
+        return text
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?")[0].rstrip("/")
+                server.requests[path.rsplit("/v1", 1)[-1]] += 1
+                time.sleep(server.latency)
+
+                if path.endswith("/completions"):
+                    self._completions(json.loads(body))
+                elif path.endswith("/embeddings"):
+                    self._embeddings(json.loads(body))
+                elif path.endswith("/audio/transcriptions"):
+                    self._send_json({"text": server.next_transcription()})
+                else:
+                    self.send_error(404)
+
+            def _completions(self, request: dict):
+                prompts = request.get("prompt", "")
+                prompts = prompts if isinstance(prompts, list) and prompts and not isinstance(prompts[0], int) else [prompts]
+                tokens = server.completion_tokens_text()
+                delay = 1 / server.token_rate if server.token_rate > 0 else 0.0
+
+                if not request.get("stream"):
+                    time.sleep(delay * len(tokens))
+                    self._send_json({
+                        "id": "cmpl-bench",
+                        "object": "text_completion",
+                        "created": int(time.time()),
+                        "model": request.get("model", "bench"),
+                        "choices": [
+                            {"text": "".join(tokens), "index": i, "logprobs": None, "finish_reason": "stop"}
+                            for i in range(len(prompts))
+                        ],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens) * len(prompts),
+                                  "total_tokens": len(tokens) * len(prompts)},
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for n, token in enumerate(tokens):
+                    time.sleep(delay)
+                    for i in range(len(prompts)):
+                        chunk = {
+                            "id": "cmpl-bench",
+                            "object": "text_completion",
+                            "created": int(time.time()),
+                            "model": request.get("model", "bench"),
+                            "choices": [{"text": token, "index": i, "logprobs": None,
+                                         "finish_reason": "stop" if n == len(tokens) - 1 else None}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def _embeddings(self, request: dict):
+                inputs = request.get("input", [])
+                if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                    inputs = [inputs]
+                vectors = [server.embed(item) for item in inputs]
+                if request.get("encoding_format") == "base64":
+                    embeddings = [base64.b64encode(vector.tobytes()).decode("ascii") for vector in vectors]
+                else:
+                    embeddings = [vector.tolist() for vector in vectors]
+                self._send_json({
+                    "object": "list",
+                    "data": [{"object": "embedding", "index": i, "embedding": e} for i, e in enumerate(embeddings)],
+                    "model": request.get("model", "bench"),
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                })
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with FakeOpenAIServer() as fake_server:
+        print(f"Fake OpenAI API listening on {fake_server.url}, press Ctrl+C to stop.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+
+PRODUCTS = ["Zephyr", "Aurora", "Nimbus", "Cirrus", "Stratus", "Vega"]
+
+
+def write_document(path: str, size: int, seed: int = 0) -> str:
+    """
+    Write a synthetic pricing document of roughly size characters, full of product names
+    and figures like the documents the assistant is usually given.
+
+    :param path: Where to write the document, as a .txt file.
+    :param size: The number of characters to write.
+    :param seed: Seeds the generated figures.
+    :return: The path the document was written to.
+    """
+    rng = np.random.default_rng(seed)
+    paragraphs = []
+    length = 0
+    while length < size:
+        product = PRODUCTS[rng.integers(len(PRODUCTS))]
+        paragraph = (
+            f"The {product} X{rng.integers(100, 999)} plan costs {rng.integers(1, 9)},{rng.integers(100, 999)} "
+            f"per seat per year. Customers report a {rng.integers(5, 60)} percent reduction in onboarding time "
+            f"and payback within {rng.integers(1, 12)}.{rng.integers(0, 9)} months. Support is included for "
+            f"teams of up to {rng.integers(10, 500)} people, with discounts of {rng.integers(5, 30)} percent "
+            f"on multi-year contracts."
+        )
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as fw:
+        fw.write("\n\n".join(paragraphs)[:size])
+    return path
+
+
+def speech_like(duration: float, samplerate: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    A voiced, speech-like signal: harmonics of a wavering fundamental, amplitude modulated
+    at a syllable rate, which the voice activity detector treats as speech.
+    """
+    t = np.arange(int(duration * samplerate)) / samplerate
+    fundamental = 140 + 20 * np.sin(2 * np.pi * 0.7 * t + rng.uniform(0, np.pi))
+    phase = 2 * np.pi * np.cumsum(fundamental) / samplerate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = 0.6 + 0.4 * np.abs(np.sin(2 * np.pi * 2 * t))
+    return 0.2 * voice * syllables
+
+
+def utterance_boundaries(count: int, utterance_secs: float, gap_secs: float = 2.5) -> list[tuple[float, float]]:
+    """
+    The start and end time in seconds of each utterance in a file written by write_utterances
+    with the same arguments.
+    """
+    return [(gap_secs + i * (gap_secs + utterance_secs), (i + 1) * (gap_secs + utterance_secs))
+            for i in range(count)]
+
+
+def write_utterances(path: str, samplerate: int, count: int, utterance_secs: float,
+                     gap_secs: float = 2.5, noise: float = 1e-4, seed: int = 0) -> str:
+    """
+    Write a WAV file of count utterances, each utterance_secs long, separated by gap_secs of
+    near silence, to be played through a FileSource.
+
+    :param path: Where to write the WAV file.
+    :param samplerate: The samplerate of the file, which must match the recorder's.
+    :param count: The number of utterances.
+    :param utterance_secs: The length of each utterance in seconds.
+    :param gap_secs: The silence before and between utterances in seconds, long enough for
+        the endpointer to end each one.
+    :param noise: The level of the background noise.
+    :param seed: Seeds the generated audio.
+    :return: The path the file was written to.
+    """
+    rng = np.random.default_rng(seed)
+    gap = int(gap_secs * samplerate)
+    parts = []
+    for _ in range(count):
+        parts.append(np.zeros(gap))
+        parts.append(speech_like(utterance_secs, samplerate, rng))
+    parts.append(np.zeros(gap))
+
+    audio = np.concatenate(parts)
+    audio += noise * rng.standard_normal(len(audio))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sf.write(path, audio.astype(np.float32), samplerate)
+    return path
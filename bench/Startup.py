@@ -0,0 +1,113 @@
+"""
+Measures how long the assistant takes to start recording after it is launched, which is
+what a rep waits for at the start of a call. Each run starts a fresh interpreter that runs
+AIAssistant.prepare, the startup path of AIAssistant.main, with WAV fixtures played in place
+of the speaker and microphone and a local fake OpenAI server in place of the API. It reports
+when the first audio is captured, when the LLM stack has loaded and when the call's pipeline
+has started.
+
+Exits with status 1 if the median time to the first audio is over the target, so it can
+be used as a check.
+
+Usage: python bench/Startup.py [--runs 5] [--target 0.5] [--json results.jsonl]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from FakeOpenAIServer import FakeOpenAIServer
+from Fixtures import write_utterances
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+SAMPLERATE = 40000  # the samplerate AIAssistant records at
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {src_dir!r})
+start = time.time()
+
+import AIAssistant
+from Recorder import FileSource
+imported = time.time()
+
+class TimedSource(FileSource):
+    first_audio = None
+
+    def record(self, numframes):
+        frames = super().record(numframes)
+        if TimedSource.first_audio is None:
+            TimedSource.first_audio = time.time()
+        return frames
+
+AIAssistant.collect_metrics = False
+session, llm, api_client = AIAssistant.prepare(callee_source=TimedSource({wav_path!r}, {samplerate}, realtime=True),
+                                               caller_source=FileSource({wav_path!r}, {samplerate}, realtime=True))
+loaded = time.time()
+while TimedSource.first_audio is None:
+    time.sleep(0.001)
+session.start()
+started = time.time()
+
+session.stop()
+llm.stop()
+api_client.close()
+print("startup", start, imported, TimedSource.first_audio, loaded, started)
+"""
+
+
+def measure(wav_path: str, workspace: str, api_url: str) -> dict[str, float]:
+    """
+    Launch the assistant in a fresh interpreter, returning the seconds from launch to each
+    milestone.
+    """
+    code = CHILD.format(src_dir=os.path.abspath(SRC_DIR), wav_path=wav_path, samplerate=SAMPLERATE)
+    env = dict(os.environ, OPENAI_API_KEY="bench", OPENAI_BASE_URL=api_url, OPENAI_API_BASE=api_url)
+    launched = time.time()
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True,
+                            cwd=workspace, env=env).stdout
+    line = next(line for line in reversed(output.splitlines()) if line.startswith("startup "))
+    start, imported, first_audio, loaded, started = map(float, line.split()[1:])
+    return {
+        "interpreter": start - launched,
+        "import": imported - launched,
+        "first audio": first_audio - launched,
+        "llm stack loaded": loaded - launched,
+        "pipeline started": started - launched,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long the assistant takes to start recording.")
+    parser.add_argument("--runs", type=int, default=5, help="The number of launches to measure.")
+    parser.add_argument("--target", type=float, default=0.5,
+                        help="The longest acceptable median time to the first audio, in seconds.")
+    parser.add_argument("--json", help="Append the result to this file as a JSON object.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="startup_") as workspace, FakeOpenAIServer() as server:
+        os.makedirs(os.path.join(workspace, "doc"))
+        wav_path = write_utterances(os.path.join(workspace, "call.wav"), SAMPLERATE, count=1, utterance_secs=1.0)
+        runs = [measure(wav_path, workspace, server.url) for _ in range(args.runs)]
+
+    medians = {milestone: statistics.median(run[milestone] for run in runs) for milestone in runs[0]}
+    print(f"Startup over {args.runs} runs (median ms from launch):")
+    for milestone, seconds in medians.items():
+        print(f"  {milestone:<18}{seconds * 1000:>10.1f}")
+
+    passed = medians["first audio"] <= args.target
+    print(f"First audio {'within' if passed else 'OVER'} the {args.target * 1000:.0f} ms target.")
+    if args.json:
+        with open(args.json, "a") as fw:
+            fw.write(json.dumps({"runs": args.runs, "target": args.target, "passed": passed,
+                                 "median": medians}) + "\n")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Checks the voice activity detector and endpointer offline against WAV fixtures whose speech
+boundaries are known. For each samplerate, utterance length and noise level it checks that
+VoiceActivityDetector.segments finds every utterance within one block of where it starts and
+ends, and that the Endpointer, fed the recording block by block as the Recorder does, ends
+each utterance about min_silence after the speech stops.
+
+Exits with status 1 if any check fails, so it can be used as a check.
+
+Usage: python bench/VadCheck.py [--samplerates 16000 40000] [--utterance-secs 1 3] [--noise 0.0001 0.003]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from Fixtures import utterance_boundaries, write_utterances
+from VoiceActivityDetector import Endpointer, VoiceActivityDetector
+
+BLOCK_SECS = 0.1  # the Recorder reads and classifies audio in blocks of 0.1 secs
+
+
+def endpoints(audio: np.ndarray, samplerate: int, min_silence: float, max_silence: float) -> list[tuple[float, float]]:
+    """
+    Cut a recording into utterances the way Recorder.record_audio does: wait for a block with
+    speech, then feed blocks to an Endpointer until it ends the utterance.
+
+    :return: The time in seconds of the first block of each utterance, and of the end of the
+        block that ended it.
+    """
+    vad = VoiceActivityDetector(samplerate)
+    block = int(samplerate * BLOCK_SECS)
+    blocks = [audio[i:i + block] for i in range(0, len(audio) - block + 1, block)]
+
+    utterances = []
+    i = 0
+    while i < len(blocks):
+        if not vad.is_speech(blocks[i]):
+            i += 1
+            continue
+        start = i
+        endpointer = Endpointer(vad, min_silence=min_silence, max_silence=max_silence)
+        endpointer.update(blocks[i])
+        i += 1
+        while i < len(blocks) and not endpointer.update(blocks[i]):
+            i += 1
+        utterances.append((start * BLOCK_SECS, (i + 1) * BLOCK_SECS))
+        i += 1
+    return utterances
+
+
+def check_case(path: str, samplerate: int, utterance_secs: float, noise: float, count: int,
+               min_silence: float, max_silence: float) -> list[str]:
+    """
+    Check the detector and endpointer against one fixture.
+
+    :return: A description of every mismatch, empty if the case passes.
+    """
+    write_utterances(path, samplerate, count, utterance_secs, noise=noise)
+    audio, _ = sf.read(path, dtype="float32")
+    expected = utterance_boundaries(count, utterance_secs)
+    failures = []
+
+    segments = VoiceActivityDetector(samplerate).segments(audio)
+    if len(segments) != len(expected):
+        failures.append(f"segments found {len(segments)} utterances, expected {len(expected)}: {segments}")
+    else:
+        for (start, end), (true_start, true_end) in zip(segments, expected):
+            if abs(start - true_start) > BLOCK_SECS or abs(end - true_end) > BLOCK_SECS:
+                failures.append(f"segment {start:.2f}-{end:.2f}s, expected {true_start:.2f}-{true_end:.2f}s")
+
+    utterances = endpoints(audio, samplerate, min_silence, max_silence)
+    if len(utterances) != len(expected):
+        failures.append(f"the endpointer cut {len(utterances)} utterances, expected {len(expected)}: {utterances}")
+    else:
+        for (start, end), (true_start, true_end) in zip(utterances, expected):
+            if abs(start - true_start) > BLOCK_SECS:
+                failures.append(f"utterance started at {start:.2f}s, expected {true_start:.2f}s")
+            if abs(end - (true_end + min_silence)) > BLOCK_SECS:
+                failures.append(f"utterance ended at {end:.2f}s, expected about {true_end + min_silence:.2f}s "
+                                f"({min_silence}s after the speech)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the voice activity detector against fixtures.")
+    parser.add_argument("--samplerates", type=int, nargs="+", default=[16000, 40000])
+    parser.add_argument("--utterance-secs", type=float, nargs="+", default=[1.0, 3.0],
+                        help="The lengths of the utterances, in seconds.")
+    parser.add_argument("--noise", type=float, nargs="+", default=[1e-4, 3e-3],
+                        help="The levels of the background noise.")
+    parser.add_argument("--utterances", type=int, default=3, help="The number of utterances in each fixture.")
+    parser.add_argument("--min-silence", type=float, default=0.3)
+    parser.add_argument("--max-silence", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix="vad_") as workspace:
+        for samplerate in args.samplerates:
+            for utterance_secs in args.utterance_secs:
+                for noise in args.noise:
+                    failures = check_case(os.path.join(workspace, "call.wav"), samplerate, utterance_secs, noise,
+                                          args.utterances, args.min_silence, args.max_silence)
+                    status = "ok" if not failures else "FAILED"
+                    print(f"samplerate={samplerate}, utterances={utterance_secs} secs, noise={noise}: {status}")
+                    for failure in failures:
+                        print(f"  {failure}")
+                    failed += bool(failures)
+
+    print(f"{failed} of {len(args.samplerates) * len(args.utterance_secs) * len(args.noise)} cases failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import httpx
+from openai import OpenAI
+
+from Metrics import metrics
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before retrying a failed request, and when to hedge a slow one.
+    """
+
+    RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+    def __init__(self, max_retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0,
+                 deadline: float | None = 60.0, hedge_after: float | None = None):
+        """
+        :param max_retries: The number of times a request is retried after the first attempt.
+        :param backoff: The base delay in seconds, doubled after each failed attempt.
+        :param max_backoff: The longest delay between attempts in seconds.
+        :param deadline: The number of seconds a request may take across all its attempts,
+            None for no limit beyond the timeouts of each attempt.
+        :param hedge_after: If an attempt has not responded within this many seconds, send a
+            second copy of it and use whichever responds first. None disables hedging.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+
+    def should_retry(self, response: httpx.Response) -> bool:
+        return response.status_code in self.RETRY_STATUSES
+
+    def delay(self, attempt: int, response: httpx.Response | None = None) -> float:
+        """
+        The delay before the given retry, with full jitter so clients that failed together do
+        not retry together. A Retry-After header given in seconds is respected, up to max_backoff.
+        """
+        if response is not None:
+            try:
+                return min(float(response.headers["Retry-After"]), self.max_backoff)
+            except (KeyError, ValueError):
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def gives_up(self, attempt: int, delay: float, ends_at: float | None) -> bool:
+        """
+        Whether to stop after the given attempt, because the retries are used up or waiting
+        would take the request past its deadline.
+        """
+        return attempt >= self.max_retries or (ends_at is not None and time.monotonic() + delay >= ends_at)
+
+    def start(self) -> float | None:
+        """
+        The time by which a request starting now must finish, or None if there is no deadline.
+        """
+        return None if self.deadline is None else time.monotonic() + self.deadline
+
+    @staticmethod
+    def prepare(request: httpx.Request, ends_at: float | None) -> float | None:
+        """
+        Shorten the request's timeouts to the time left before the deadline.
+
+        :return: The time left, or None if there is no deadline.
+        """
+        if ends_at is None:
+            return None
+        remaining = ends_at - time.monotonic()
+        if remaining <= 0:
+            raise httpx.TimeoutException("The request deadline was exceeded.", request=request)
+        timeout = dict(request.extensions.get("timeout", {}))
+        for key in ("connect", "read", "write", "pool"):
+            timeout[key] = remaining if timeout.get(key) is None else min(timeout[key], remaining)
+        request.extensions = {**request.extensions, "timeout": timeout}
+        return remaining
+
+
+class RetryTransport(httpx.BaseTransport):
+    """
+    Wraps a transport with the retries, deadline and hedging of a RetryPolicy.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, policy: RetryPolicy):
+        self.transport = transport
+        self.policy = policy
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()  # buffer the body so it can be sent again
+        ends_at = self.policy.start()
+        attempt = 0
+        while True:
+            self.policy.prepare(request, ends_at)
+            error = response = None
+            try:
+                response = self._send(request)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and not self.policy.should_retry(response):
+                return response
+
+            delay = self.policy.delay(attempt, response)
+            if self.policy.gives_up(attempt, delay, ends_at):
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            metrics.observe("api_retry_wait", delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        if self.policy.hedge_after is None:
+            return self.transport.handle_request(request)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="hedged-request")
+            executor = self._executor
+
+        futures = [executor.submit(self.transport.handle_request, request)]
+        done, _ = wait(futures, timeout=self.policy.hedge_after)
+        if not done:
+            metrics.observe("api_hedge", self.policy.hedge_after)
+            futures.append(executor.submit(self.transport.handle_request, request))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for other in pending:  # close the slower copy once it responds
+                    other.add_done_callback(_close_response)
+                for other in done - {future}:
+                    _close_response(other)
+                return future.result()
+        raise error
+
+    def close(self):
+        self.transport.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def _close_response(future: Future):
+    if future.exception() is None:
+        future.result().close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps an async transport with the retries, deadline and hedging of a RetryPolicy.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, policy: RetryPolicy):
+        self.transport = transport
+        self.policy = policy
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()  # buffer the body so it can be sent again
+        ends_at = self.policy.start()
+        attempt = 0
+        while True:
+            self.policy.prepare(request, ends_at)
+            error = response = None
+            try:
+                response = await self._send(request)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and not self.policy.should_retry(response):
+                return response
+
+            delay = self.policy.delay(attempt, response)
+            if self.policy.gives_up(attempt, delay, ends_at):
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                await response.aclose()
+            metrics.observe("api_retry_wait", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        if self.policy.hedge_after is None:
+            return await self.transport.handle_async_request(request)
+
+        tasks = [asyncio.create_task(self.transport.handle_async_request(request))]
+        done, _ = await asyncio.wait(tasks, timeout=self.policy.hedge_after)
+        if not done:
+            metrics.observe("api_hedge", self.policy.hedge_after)
+            tasks.append(asyncio.create_task(self.transport.handle_async_request(request)))
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for other in pending:  # the slower copy is no longer needed
+                    other.cancel()
+                for other in done - {task}:
+                    if other.exception() is None:
+                        await other.result().aclose()
+                return task.result()
+        raise error
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ApiClient:
+    """
+    The HTTP clients shared by every call to the OpenAI API, so that transcription, embedding
+    and completion requests reuse one pool of keep-alive connections and follow the same
+    timeouts, retries and hedging.
+
+    Retries are handled here rather than by the OpenAI SDK, so the SDK clients are created
+    with their own retries turned off.
+    """
+
+    def __init__(self, timeout: float = 30.0, connect_timeout: float = 5.0, policy: RetryPolicy | None = None,
+                 max_connections: int = 20, max_keepalive_connections: int = 10, keepalive_expiry: float = 60.0):
+        """
+        :param timeout: The number of seconds to wait for each read, write or pooled connection.
+        :param connect_timeout: The number of seconds to wait to connect.
+        :param policy: The retry, deadline and hedging policy, defaults to RetryPolicy().
+        :param max_connections: The maximum number of open connections.
+        :param max_keepalive_connections: The maximum number of idle connections kept open.
+        :param keepalive_expiry: The number of seconds an idle connection is kept open.
+        """
+        self.policy = policy or RetryPolicy()
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+
+        self.http_client = httpx.Client(
+            timeout=self.timeout, transport=RetryTransport(httpx.HTTPTransport(limits=limits), self.policy)
+        )
+        self.http_async_client = httpx.AsyncClient(
+            timeout=self.timeout, transport=AsyncRetryTransport(httpx.AsyncHTTPTransport(limits=limits), self.policy)
+        )
+
+    def openai(self, api_key: str | None) -> OpenAI:
+        """
+        An OpenAI SDK client that sends its requests through the shared pool.
+        """
+        return OpenAI(api_key=api_key, http_client=self.http_client, timeout=self.timeout, max_retries=0)
+
+    def langchain_kwargs(self, timeout: float | None = None) -> dict:
+        """
+        The arguments that make a langchain_openai model or embeddings use the shared pool.
+
+        :param timeout: Overrides the timeout of the shared clients for this model.
+        """
+        return {
+            "http_client": self.http_client,
+            "http_async_client": self.http_async_client,
+            "timeout": self.timeout if timeout is None else timeout,
+            "max_retries": 0,
+        }
+
+    def warm_up(self, base_url: str | None = None):
+        """
+        Open a connection to the API ahead of the first request, so that it does not wait for
+        the TCP and TLS handshakes. Failures are ignored, the first request then connects itself.
+
+        :param base_url: The API's url, defaults to OPENAI_BASE_URL or OpenAI's own.
+        """
+        base_url = base_url or os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+        try:
+            self.http_client.head(base_url)  # the connection is kept alive in the pool
+        except httpx.HTTPError:
+            pass
+
+    async def aclose(self):
+        """
+        Close both clients and their connection pools, from the event loop the async client
+        was used on, whose connections can only be closed there.
+        """
+        self.http_client.close()
+        await self.http_async_client.aclose()
+
+    def close(self):
+        """
+        Close both clients and their connection pools. The async client is closed on an event
+        loop of its own, so code that used it from a loop that is still running should await
+        aclose instead.
+        """
+        self.http_client.close()
+        if self.http_async_client.is_closed:
+            return
+        try:
+            asyncio.run(self.http_async_client.aclose())
+        except RuntimeError as e:  # its connections belong to an event loop that has been closed
+            print(f"Failed to close the async HTTP client cleanly: {e}")
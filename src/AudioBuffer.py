@@ -0,0 +1,151 @@
+import threading
+
+import numpy as np
+
+
+class AudioBuffer:
+    """
+    A preallocated buffer that recorded frames are copied into in place, growing by doubling
+    when full, so recording an utterance copies each sample a constant number of times
+    instead of concatenating every frame recorded so far.
+    """
+
+    def __init__(self, initial_capacity: int):
+        """
+        :param initial_capacity: The number of frames to allocate space for up front.
+        """
+        self.initial_capacity = initial_capacity
+        self._data: np.ndarray | None = None
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, data: np.ndarray):
+        """
+        Copy frames into the end of the buffer. The buffer takes its channel count and dtype
+        from the first frames appended.
+
+        :param data: The frames to append, with shape (frames, channels).
+        """
+        if self._data is None:
+            self._data = np.empty((max(self.initial_capacity, len(data)), *data.shape[1:]), dtype=data.dtype)
+
+        end = self._length + len(data)
+        if end > len(self._data):
+            grown = np.empty((max(end, 2 * len(self._data)), *self._data.shape[1:]), dtype=self._data.dtype)
+            grown[:self._length] = self._data[:self._length]
+            self._data = grown
+
+        self._data[self._length:end] = data
+        self._length = end
+
+    def view(self) -> np.ndarray:
+        """
+        Get the frames recorded so far, without copying them. The view is only valid until
+        the next append or clear.
+        """
+        if self._data is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._data[:self._length]
+
+    def clear(self):
+        """
+        Empty the buffer, keeping its allocated space for reuse.
+        """
+        self._length = 0
+
+
+class RingBuffer:
+    """
+    A fixed-capacity, thread-safe ring buffer that a capture thread writes frames into and
+    readers consume from at their own pace. Frames are addressed by their absolute position
+    in the stream, so a reader that falls more than the capacity behind loses the oldest
+    frames rather than blocking the writer.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: The number of frames kept before the oldest are overwritten.
+        """
+        self.capacity = capacity
+        self._data: np.ndarray | None = None
+        self._written = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @property
+    def written(self) -> int:
+        """
+        The total number of frames written since the buffer was created.
+        """
+        with self._condition:
+            return self._written
+
+    def write(self, data: np.ndarray):
+        """
+        Copy frames into the buffer, overwriting the oldest frames once it is full. The buffer
+        takes its channel count and dtype from the first frames written.
+
+        :param data: The frames to write, with shape (frames, channels).
+        """
+        data = data[-self.capacity:]
+        with self._condition:
+            if self._data is None:
+                self._data = np.zeros((self.capacity, *data.shape[1:]), dtype=data.dtype)
+
+            start = self._written % self.capacity
+            first = min(len(data), self.capacity - start)
+            self._data[start:start + first] = data[:first]
+            self._data[:len(data) - first] = data[first:]
+
+            self._written += len(data)
+            self._condition.notify_all()
+
+    def read(self, start: int, numframes: int) -> tuple[int, np.ndarray]:
+        """
+        Read frames from the buffer, waiting until they have been written.
+
+        :param start: The absolute position of the first frame to read.
+        :param numframes: The number of frames to read.
+        :return: The absolute position the frames were actually read from, which is later than
+            start if those frames were already overwritten, and a copy of the frames.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._closed or self._written >= start + numframes)
+            if self._written < start + numframes:
+                raise EOFError("The audio capture has stopped.")
+
+            start = max(start, self._written - self.capacity)
+            indices = np.arange(start, start + numframes) % self.capacity
+            return start, self._data[indices]
+
+    def close(self):
+        """
+        Mark the stream as finished, waking up any readers waiting for frames.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class RingBufferReader:
+    """
+    Reads consecutive frames from a RingBuffer through the same record(numframes) interface
+    as a soundcard recorder, so it can be used wherever a device recorder is.
+    """
+
+    def __init__(self, ring: RingBuffer, position: int | None = None):
+        """
+        :param ring: The buffer to read from.
+        :param position: The absolute position to start reading from, defaults to the newest frame.
+        """
+        self.ring = ring
+        self.position = ring.written if position is None else position
+
+    def record(self, numframes: int) -> np.ndarray:
+        start, data = self.ring.read(self.position, numframes)
+        if start > self.position:
+            print(f"Audio capture buffer overflowed, {start - self.position} frames were dropped.")
+        self.position = start + numframes
+        return data
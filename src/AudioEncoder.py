@@ -0,0 +1,66 @@
+import io
+
+import numpy as np
+import soundfile as sf
+
+
+class AudioEncoder:
+    """
+    Prepares recorded audio for transcription in memory: downmixes it to mono, resamples it
+    to the rate Whisper works at and encodes it losslessly, which is several times smaller
+    than the float WAV the recorder captures.
+    """
+
+    def __init__(self, samplerate=16000, format="FLAC", subtype="PCM_16", filter_taps=63):
+        """
+        :param samplerate: The samplerate to resample the audio to.
+        :param format: The container format, any format soundfile can write to a buffer.
+        :param subtype: The sample encoding within the container.
+        :param filter_taps: The length of the low-pass filter applied before downsampling.
+        """
+        self.samplerate = samplerate
+        self.format = format
+        self.subtype = subtype
+        self.filter_taps = filter_taps
+
+    @property
+    def extension(self) -> str:
+        return self.format.lower()
+
+    def resample(self, data: np.ndarray, samplerate: int) -> np.ndarray:
+        """
+        Downmix audio to mono and resample it to this encoder's samplerate.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :param samplerate: The samplerate of the audio.
+        :return: The resampled mono audio.
+        """
+        samples = data.mean(axis=1) if data.ndim > 1 else data
+        if samplerate == self.samplerate or len(samples) == 0:
+            return samples.astype(np.float32, copy=False)
+
+        if self.samplerate < samplerate:
+            # windowed-sinc low-pass at the new Nyquist frequency, so downsampling doesn't alias
+            cutoff = 0.5 * self.samplerate / samplerate
+            taps = np.arange(self.filter_taps) - (self.filter_taps - 1) / 2
+            kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(self.filter_taps)
+            samples = np.convolve(samples, kernel / kernel.sum(), mode="same")
+
+        duration = len(samples) / samplerate
+        times = np.arange(int(duration * self.samplerate)) / self.samplerate
+        return np.interp(times, np.arange(len(samples)) / samplerate, samples).astype(np.float32)
+
+    def encode(self, data: np.ndarray, samplerate: int, name: str = "audio") -> io.BytesIO:
+        """
+        Resample and encode audio into an in-memory file.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :param samplerate: The samplerate of the audio.
+        :param name: The file name to give the buffer, without an extension.
+        :return: The encoded audio, with its name set so it can be uploaded like a file.
+        """
+        buffer = io.BytesIO()
+        sf.write(buffer, self.resample(data, samplerate), self.samplerate, format=self.format, subtype=self.subtype)
+        buffer.seek(0)
+        buffer.name = f"{name}.{self.extension}"
+        return buffer
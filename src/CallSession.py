@@ -0,0 +1,497 @@
+import difflib
+import os
+import re
+import threading
+from queue import Queue
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from Pipeline import Pipeline, put_latest
+from Recorder import Recorder
+from Summariser import Summariser
+from Transcript import TranscriptWindow, Utterance
+
+if TYPE_CHECKING:  # loading the LLM stack takes seconds, so it is left to the caller
+    from LLMQuery import LLMQuery
+    from SpeechToText import AudioTranscriber
+
+
+def get_files_in(directory, ignored_files):
+    """
+    Get a list of files in a directory, sorted by creation time.
+
+    :param directory: Path to the directory to scan.
+    :param ignored_files: A list of files to ignore in the scan.
+
+    :return: A list of file paths, sorted by creation time.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename not in ignored_files:
+                files.append(os.path.join(root, filename))
+    return files
+
+
+class _Speculation:
+    """
+    Suggestions generated from a partial transcription of an utterance still being spoken.
+    """
+
+    __slots__ = ("number", "text", "base", "result", "done")
+
+    def __init__(self, number: int, text: str, base: tuple[Utterance, ...]):
+        """
+        :param number: The number of the callee utterance the partial transcription is of.
+        :param text: The partial transcription.
+        :param base: The transcript the suggestions were generated from, before the utterance.
+        """
+        self.number = number
+        self.text = text
+        self.base = base
+        self.result: str | None = None
+        self.done = threading.Event()
+
+
+class CallSession:
+    """
+    A single call: its recorders, transcript, summary and working directories, and the
+    pipeline connecting them. The LLM, and with it the document index and API client pool,
+    and the transcriber are shared between sessions, while everything said in a call stays
+    in its own session, so one process can host many calls at once.
+
+    Each speaker's recorder feeds a recording stage, all of which feed a transcription
+    stage, which feeds a suggestion stage. Suggestions are passed to render as they arrive.
+
+    In speculative mode, the callee's utterance is also transcribed while it is still being
+    spoken, and suggestions are generated for it straight away, so that most of the LLM's
+    latency is hidden behind the callee talking. When the utterance ends, the speculative
+    suggestions are shown if its final transcription is close enough to the partial one,
+    otherwise they are dropped and generated again.
+    """
+
+    ID_PATTERN = re.compile(r"^[\w-]{1,64}$")
+
+    SUGGESTION_PROMPT = """
+Your role is a caller making a call to a company, the purpose is to sell a product/service to the other party.
+You can only use stats and figures that are given in the context provided.
+If you give stats and figures, you explain how you obtained them.
+You do not hallucinate data.
+You do not give generic answers.
+You say 'void' if you cannot find anything relevant to say
+
+---------------------
+Here is a summary of the current conversation:
+{summary}
+
+---------------------
+
+Here is the transcript between the caller and callee:
+{transcript}
+
+---------------------
+
+Please suggest up to 3 possible sentences that could help increase the chances of this call going well, do not number these sentences.
+Only write sentences that use information that is specific to either the call or the context provided.
+Make sure your output is short, snappy and to the point, writing each point on a new line.
+Make sure the sentences you suggest are relevant to the previous point the callee has mentioned.
+"""
+
+    SUMMARY_PROMPT = """
+Your role is to summarise transcripts from the callee in an audio call in order to reduce the number of words/tokens that a summary takes up. You generally do not exceed 500 tokens.
+You also preserve key information obtained in the meeting such as the company name, their goals and motivations, as well as any other relevant information that a telemarketer could use to help with the sale of their product.
+
+Here is the current summary:
+{summary}
+
+Here are the current transcripts:
+{transcripts}
+
+Please update the current summary with the current transcriptions to generate a new transcription.
+"""
+
+    def __init__(self, session_id: str, llm: "LLMQuery", transcriber: "AudioTranscriber",
+                 render: Callable[[Iterator[str], Callable[[], bool]], None], session_dir: str = ".",
+                 doc_dir: str = "doc/", debug: bool = False, stream_suggestions: bool = True,
+                 transcript_tokens: int = 1000, speculative: bool = False, reuse_ratio: float = 0.8,
+                 context_tokens: int = 1000, cache_turns: int = 3, min_cache_words: int = 4,
+                 share_cache: bool = False):
+        """
+        :param session_id: Identifies the call, letters, digits, underscores and dashes only.
+        :param llm: The LLM shared by every session.
+        :param transcriber: The transcriber shared by every session.
+        :param render: Shows the suggestions for the caller. It is given an iterator over the
+            suggestions and a function returning whether they are out of date, in which case
+            the rest should be dropped.
+        :param session_dir: The directory holding the session's tmp/, rec/ and debug/ directories.
+        :param doc_dir: The directory of documents used as context.
+        :param debug: Log each transcription to debug/transcript.txt.
+        :param stream_suggestions: Show suggestions as they are generated, rather than ranked once they all are.
+        :param transcript_tokens: The number of tokens of transcript kept before older utterances are summarised.
+        :param speculative: Generate suggestions from the callee's utterances while they are still
+            being spoken, as often as the callee's recorder reports partial audio.
+        :param reuse_ratio: How similar, from 0 to 1, the partial and final transcriptions of an
+            utterance must be for the speculative suggestions to be shown.
+        :param context_tokens: The number of tokens of each suggestion prompt kept for document
+            context. The summary and transcript are cut down to fit the rest of the LLM's prompt budget.
+        :param cache_turns: The number of the latest utterances that make up the key of cached
+            responses, so a response is only reused when the conversation leading up to it is similar.
+        :param min_cache_words: Utterances with fewer words than this, such as "Okay." or "Yes.", say
+            too little about the conversation to match cached responses on, so they are never cached.
+        :param share_cache: Serve responses cached by other calls sharing the LLM. Off by default,
+            as the cached suggestions and their keys are drawn from each call's transcript.
+        """
+        if not self.ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id}. Please use letters, digits, underscores and dashes.")
+
+        self.session_id = session_id
+        self.llm = llm
+        self.transcriber = transcriber
+        self.render = render
+        self.session_dir = session_dir
+        self.doc_dir = doc_dir
+        self.debug = debug
+        self.stream_suggestions = stream_suggestions
+        self.speculative = speculative
+        self.reuse_ratio = reuse_ratio
+        self.context_tokens = context_tokens
+        self.cache_turns = cache_turns
+        self.min_cache_words = min_cache_words
+        self.cache_scope = None if share_cache else session_id
+
+        self.summariser = Summariser(self.summarise, snapshot_path=self.path("tmp", "summary.txt"))
+        self.transcript = TranscriptWindow(token_budget=transcript_tokens, count_tokens=llm.token_counter.count,
+                                           on_evict=lambda utterance: self.summariser.add(str(utterance)))
+        self.recorders: list[Recorder] = []
+
+        self.file_lock = threading.Lock()
+        self.suggestion_jobs = Queue(maxsize=1)  # only the newest job is kept, older ones are stale
+        self.suggestion_lock = threading.Lock()
+        self.latest_suggestion_job = 0
+
+        self.partials = Queue(maxsize=1)  # only the newest partial audio is worth transcribing
+        self.speculation_lock = threading.Lock()
+        self.recorded_utterances = 0  # callee utterances recorded so far, which tells partials apart
+        self.speculation: _Speculation | None = None
+
+        self.utterances = Queue(maxsize=4)
+        self.pipeline = Pipeline()
+        self.pipeline.add_stage("transcription", self.process_utterance, inbox=self.utterances,
+                                feeds=(self.suggestion_jobs,))
+        self.pipeline.add_stage("suggestion", self.suggest, inbox=self.suggestion_jobs)
+        if speculative:
+            self.pipeline.add_stage("speculation", self.speculate, inbox=self.partials)
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.session_dir, *parts)
+
+    def cleanup(self):
+        """
+        Cleans up the past session data by removing the data stores in tmp/, rec/ and debug/
+        """
+        directories_to_clean = ['tmp', 'rec', 'debug']
+        for directory in directories_to_clean:
+            directory = self.path(directory)
+            os.makedirs(directory, exist_ok=True)
+            for filename in os.listdir(directory):
+                file_path = os.path.join(directory, filename)
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+
+    def add_recorder(self, recorder: Recorder, speaker: str):
+        """
+        Add a recorder for one of the speakers, which can be done while the session is running.
+
+        :param recorder: The recorder to record from.
+        :param speaker: The label of the person being recorded, CALLEE or CALLER.
+        """
+        self.recorders.append(recorder)
+        feeds = ()
+        if self.speculative and speaker == "CALLEE":
+            recorder.on_partial = lambda audio: put_latest(self.partials, (recorder, audio, self.recorded_utterances))
+            feeds = (self.partials,)  # on_partial is called from the recording stage
+        self.pipeline.on_stop(recorder.stop)
+        self.pipeline.add_stage(f"{recorder.mode} recording", lambda: self.record_utterance(recorder, speaker),
+                                outbox=self.utterances, feeds=feeds)
+
+    def start(self):
+        self.summariser.start()
+        self.pipeline.start()
+
+    def wait(self):
+        self.pipeline.wait()
+
+    def stop(self):
+        self.pipeline.stop()
+        self.summariser.stop()
+
+    def summarise(self, prev_summary: str, transcriptions: list[str]):
+        """
+        Summarises the transcriptions into the previous summary
+
+        :param prev_summary: The summary you wish to update.
+        :param transcriptions: Any transcriptions you wish to update the summary with.
+        :return: The updated summary
+        """
+        summary, transcripts = self.fit_summary_to_budget(prev_summary, transcriptions)
+        query = self.SUMMARY_PROMPT.format(summary=summary, transcripts=transcripts)
+
+        print("Generating summary update...")
+        new_summary = self.llm.generate_query(file_paths=[], few_shot_prompts=[], query=query)
+        if not new_summary:  # the summariser keeps the previous summary and retries
+            raise ValueError("The LLM returned an empty summary.")
+        return new_summary
+
+    def fit_summary_to_budget(self, prev_summary: str, transcriptions: list[str]):
+        """
+        Cuts the summary and transcriptions down so the summary prompt fits in the LLM's prompt
+        budget. The previous summary is kept to at most half of it, and the transcriptions are
+        cut short to fit the rest, keeping their start.
+
+        :param prev_summary: The summary to update.
+        :param transcriptions: The transcriptions to add to the summary.
+        :return: The summary and the transcriptions as text
+        """
+        token_counter = self.llm.token_counter
+        budget = self.llm.query_token_budget()
+        available = budget - token_counter.count(self.SUMMARY_PROMPT.format(summary="", transcripts=""))
+        transcripts = "\n".join(transcriptions)
+
+        if token_counter.count(prev_summary) > available // 2:
+            print("Cut the previous summary short to fit the token budget.")
+            prev_summary = token_counter.truncate(prev_summary, available // 2)
+        # the parts' token counts do not quite add up to the whole prompt's, so it is checked as a whole
+        overflow = token_counter.count(self.SUMMARY_PROMPT.format(summary=prev_summary, transcripts=transcripts)) - budget
+        if overflow > 0:
+            print("Cut the transcriptions short to fit the token budget.")
+        while overflow > 0 and transcripts:
+            transcripts = token_counter.truncate(transcripts, token_counter.count(transcripts) - overflow)
+            overflow = token_counter.count(self.SUMMARY_PROMPT.format(summary=prev_summary, transcripts=transcripts)) - budget
+        return prev_summary, transcripts
+
+    def write_to_eof(self, pathname, text_to_write):
+        with self.file_lock:
+            with open(pathname, 'a') as file:
+                file.write(text_to_write)
+                file.write('\n')
+
+    def build_prompt(self, pending: str | None = None):
+        """
+        Builds the prompt used to generate responses for the caller
+
+        :param pending: A partial transcription of the callee's utterance in progress, added to the
+            end of the transcript
+        :return: The document paths to use as context, the query, and the key for cached
+            responses, None if they should not be cached
+        """
+        file_paths = get_files_in(directory=self.doc_dir, ignored_files=["tmp.txt"])
+        summary = self.summariser.text()
+        utterances = self.transcript.snapshot()
+        pending_line = str(Utterance("CALLEE", pending, tokens=0)) if pending is not None else None
+        summary, transcript = self.fit_to_budget(summary, utterances, pending_line)
+        query = self.SUGGESTION_PROMPT.format(summary=summary, transcript=transcript)
+        return file_paths, query, self.cache_key(utterances, pending)
+
+    def cache_key(self, utterances: tuple[Utterance, ...], pending: str | None = None) -> str | None:
+        """
+        The key responses are cached under: the latest cache_turns lines of the transcript, which
+        are embedded and compared with the keys of cached responses.
+
+        :param utterances: The utterances in the transcript window, oldest first.
+        :param pending: A partial transcription of the callee's utterance in progress, see build_prompt
+        :return: The key, or None if the latest utterance is too short to cache responses for
+        """
+        lines = [str(utterance) for utterance in utterances]
+        latest = utterances[-1].text if utterances else ""
+        if pending is not None:
+            lines.append(str(Utterance("CALLEE", pending, tokens=0)))
+            latest = pending
+        if len(latest.split()) < self.min_cache_words:
+            return None
+        return "\n".join(lines[-self.cache_turns:])
+
+    def fit_to_budget(self, summary: str, utterances: tuple[Utterance, ...], pending_line: str | None = None):
+        """
+        Cuts the summary and transcript down so that the suggestion prompt leaves context_tokens
+        of the LLM's prompt budget for document context. The transcript is kept first, dropping
+        its oldest utterances, and the summary is cut short to fit whatever is left.
+
+        :param summary: The summary of the call.
+        :param utterances: The utterances in the transcript window, oldest first.
+        :param pending_line: The line of an utterance in progress, added to the end of the transcript
+        :return: The summary and the transcript as text
+        """
+        count = self.llm.token_counter.count
+        available = (self.llm.prompt_token_budget - self.context_tokens
+                     - count(self.SUGGESTION_PROMPT.format(summary="", transcript="")))
+
+        lines = [str(utterance) for utterance in utterances]
+        tokens = [utterance.tokens for utterance in utterances]
+        if pending_line is not None:
+            lines.append(pending_line)
+            tokens.append(count(pending_line))
+
+        kept = []
+        for line, line_tokens in zip(reversed(lines), reversed(tokens)):
+            if line_tokens + 1 > available:  # one more for the newline
+                if not kept:  # the newest utterance alone is over the budget, so keep its end
+                    kept.append(self.llm.token_counter.truncate(line, available, keep_end=True))
+                    available = 0
+                break
+            kept.append(line)
+            available -= line_tokens + 1
+        transcript = "\n".join(reversed(kept))
+
+        if len(kept) < len(lines):
+            print(f"Dropped {len(lines) - len(kept)} utterances from the prompt to fit the token budget.")
+        if count(summary) > available:
+            print("Cut the summary short to fit the token budget.")
+            summary = self.llm.token_counter.truncate(summary, available)
+        return summary, transcript
+
+    def pass_prompt(self, pending: str | None = None):
+        """
+        Runs the prompt on the llm to generate responses for the caller
+
+        :param pending: A partial transcription of the callee's utterance in progress, see build_prompt
+        :return: The output for the caller
+        """
+        file_paths, query, cache_key = self.build_prompt(pending)
+
+        print("Generating query...")
+        output = self.llm.generate_query(
+            file_paths,
+            [],
+            query,
+            cache_key=cache_key,
+            cache_scope=self.cache_scope
+        )
+        return output
+
+    def stream_prompt(self):
+        """
+        Runs the prompt on the llm, streaming the responses for the caller as they are generated
+
+        :return: An iterator over the suggestions for the caller
+        """
+        file_paths, query, cache_key = self.build_prompt()
+
+        print("Generating query...")
+        return self.llm.stream_query(file_paths, [], query, cache_key=cache_key, cache_scope=self.cache_scope)
+
+    def record_utterance(self, recorder: Recorder, speaker: str):
+        """
+        Records the next utterance, the first stage of the pipeline.
+
+        :param recorder: The recorder to record from.
+        :param speaker: The label of the person being recorded, CALLEE or CALLER.
+        :return: The speaker label, the recorded audio, and the number of the utterance
+        """
+        print(f"Listening for audio from {recorder.mode}...")
+        audio = recorder.record()
+        if audio is None:
+            return None
+        number = None
+        if speaker == "CALLEE":
+            with self.speculation_lock:
+                number = self.recorded_utterances
+                self.recorded_utterances += 1  # partials still queued for this utterance are now stale
+        return speaker, audio, number
+
+    def process_utterance(self, utterance):
+        """
+        Transcribes an utterance and adds it to the transcript. If the callee was speaking, a new
+        suggestion job is queued, replacing any older job that has not started yet.
+
+        :param utterance: The speaker label, the recorded audio, and the number of the utterance
+        """
+        speaker, audio, number = utterance
+        print(f"Transcribing {speaker.lower()} audio...")
+        transcription = self.transcript.add(speaker, self.transcriber.transcribe(audio))  # older utterances are evicted to the summariser
+        if self.debug:
+            debug_txt = f"{audio.name} {transcription}"
+            self.write_to_eof(self.path("debug", "transcript.txt"), debug_txt)
+
+        if speaker == "CALLEE":
+            speculation = self.claim_speculation(number, transcription, self.transcript.snapshot()[:-1])
+            with self.suggestion_lock:
+                self.latest_suggestion_job += 1
+                put_latest(self.suggestion_jobs, (self.latest_suggestion_job, speculation))
+
+    def speculate(self, partial):
+        """
+        Transcribes the callee's utterance so far and generates suggestions for it, the stage
+        run in speculative mode. Partials of an utterance that has already ended are skipped.
+
+        :param partial: The recorder, the audio of the utterance so far, and the number of the utterance
+        """
+        recorder, audio, number = partial
+        if number != self.recorded_utterances:
+            return
+        text = self.transcriber.transcribe(recorder.encoder.encode(audio, recorder.samplerate, name="partial")).strip()
+        base = self.transcript.snapshot()
+        with self.speculation_lock:
+            if not text or number != self.recorded_utterances:
+                return
+            previous = self.speculation
+            if previous is not None and previous.number == number and previous.text == text:
+                return  # nothing new has been said, the suggestions in progress still apply
+            speculation = self.speculation = _Speculation(number, text, base)
+
+        print("Generating speculative response...")
+        try:
+            speculation.result = self.pass_prompt(pending=text)
+        finally:
+            speculation.done.set()
+
+    def claim_speculation(self, number: int, utterance: Utterance, earlier: tuple[Utterance, ...]):
+        """
+        Takes the speculative suggestions for a callee utterance that has just been transcribed,
+        if they were generated from the same transcript and a close enough partial transcription.
+
+        :param number: The number of the utterance.
+        :param utterance: The final transcription of the utterance.
+        :param earlier: The transcript before the utterance.
+        :return: The speculation to reuse, or None if the suggestions must be generated again
+        """
+        with self.speculation_lock:
+            speculation = self.speculation
+            if speculation is None or speculation.number > number:
+                return None  # the next utterance is already being speculated on
+            self.speculation = None
+
+        # utterances evicted from the window since the speculation started are now in the summary
+        same_transcript = speculation.base[len(speculation.base) - len(earlier):] == earlier
+        ratio = difflib.SequenceMatcher(None, speculation.text.lower(), utterance.text.lower()).ratio()
+        if speculation.number != number or not same_transcript or ratio < self.reuse_ratio:
+            return None
+        return speculation
+
+    def suggest(self, job):
+        """
+        Generates suggestions for the caller, the last stage of the pipeline. The suggestions are
+        dropped if a newer utterance from the callee arrives before they are shown.
+
+        :param job: The number of the suggestion job, used to tell whether it is stale, and the
+            speculation to reuse, if any
+        """
+        job, speculation = job
+
+        def is_stale():
+            return job != self.latest_suggestion_job
+
+        if speculation is not None:
+            print("Reusing speculative response...")
+            speculation.done.wait()
+            if speculation.result:  # otherwise the speculation failed or came back empty, so generate again
+                if not is_stale():
+                    self.render((line for line in [speculation.result]), is_stale)
+                return
+
+        print("Generating response...")
+        if self.stream_suggestions:
+            self.render(self.stream_prompt(), is_stale)
+        else:
+            message = self.pass_prompt()
+            if not message or is_stale():
+                return
+            self.render((line for line in [message]), is_stale)  # a generator, so it can be closed like a stream
@@ -0,0 +1,157 @@
+import re
+import threading
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to an estimate from the text length
+    tiktoken = None
+
+
+class TokenCounter:
+    """
+    Counts tokens with the model's own tokenizer when tiktoken is installed, memoizing the
+    count for each text since the same chunks and transcript lines are counted every turn.
+    The tokenizer is loaded on the first count, as it may have to be downloaded.
+    """
+
+    def __init__(self, model: str = "gpt-3.5-turbo-instruct", cache_size: int = 4096):
+        """
+        :param model: The model whose tokenizer is used.
+        :param cache_size: The number of texts whose token counts are remembered.
+        """
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    @property
+    def encoding(self):
+        """
+        The model's tokenizer, or None if it could not be loaded and counts are estimated.
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._encoding = self._load_encoding()
+                    self._loaded = True
+        return self._encoding
+
+    def _load_encoding(self):
+        if tiktoken is None:
+            print("tiktoken is not installed, token counts will be estimated. Install it with 'pip install tiktoken'.")
+            return None
+        try:
+            return tiktoken.encoding_for_model(self.model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:  # the encoding is downloaded on first use, which fails offline
+            print(f"Failed to load the tokenizer for {self.model}: {e}. Token counts will be estimated.")
+            return None
+
+    def _count(self, text: str) -> int:
+        encoding = self.encoding
+        if encoding is None:
+            return len(text) // 4
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int, keep_end: bool = False) -> str:
+        """
+        Cut a text down to at most max_tokens tokens.
+
+        :param text: The text to cut down.
+        :param max_tokens: The number of tokens to keep.
+        :param keep_end: Keep the end of the text rather than its start.
+        :return: The text, or as much of it as fits.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        encoding = self.encoding
+        if encoding is None:
+            chars = max_tokens * 4
+            return text[-chars:] if keep_end else text[:chars]
+        tokens = encoding.encode(text, disallowed_special=())
+        tokens = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+        return encoding.decode(tokens)
+
+
+class ContextPacker:
+    """
+    Chooses which retrieved chunks go into the prompt. Chunks are added greedily by
+    maximal marginal relevance, trading their retrieval score against how much they overlap
+    the chunks already chosen, until the token budget is full. This fills the prompt with
+    as much distinct context as fits, rather than repeating the overlap between neighbouring
+    chunks.
+    """
+
+    def __init__(self, token_counter: TokenCounter, relevance_weight: float = 0.7, duplicate_threshold: float = 0.9):
+        """
+        :param token_counter: Counts the tokens in each chunk.
+        :param relevance_weight: The weight of the retrieval score against the overlap with
+            chosen chunks, between 0 and 1.
+        :param duplicate_threshold: The overlap above which a chunk is dropped as a duplicate.
+        """
+        self.token_counter = token_counter
+        self.relevance_weight = relevance_weight
+        self.duplicate_threshold = duplicate_threshold
+
+    @staticmethod
+    def _words(text: str) -> frozenset[str]:
+        return frozenset(re.findall(r"\w+", text.lower()))
+
+    @staticmethod
+    def _overlap(a: frozenset[str], b: frozenset[str]) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def pack(self, scored_chunks: list[tuple[str, float]], token_budget: int, max_prompts: int = 1) -> list[str]:
+        """
+        Pack the chunks into up to max_prompts contexts of at most token_budget tokens each.
+
+        :param scored_chunks: The retrieved chunks and their relevance, higher is more relevant.
+        :param token_budget: The number of tokens available for the context in each prompt.
+        :param max_prompts: The number of contexts to fill.
+        :return: The contexts, each made of the chosen chunks in order of selection.
+        """
+        if not scored_chunks or token_budget <= 0:
+            return []
+
+        scores = [score for _, score in scored_chunks]
+        low, high = min(scores), max(scores)
+        candidates = [
+            (text, (score - low) / (high - low) if high > low else 1.0, self._words(text), self.token_counter.count(text))
+            for text, score in scored_chunks
+        ]
+
+        separator_tokens = self.token_counter.count("\n")
+        contexts: list[list[str]] = [[] for _ in range(max_prompts)]
+        remaining = [token_budget] * max_prompts
+        chosen: list[frozenset[str]] = []
+
+        while candidates:
+            def marginal_relevance(candidate):
+                _, relevance, words, _ = candidate
+                redundancy = max((self._overlap(words, other) for other in chosen), default=0.0)
+                return self.relevance_weight * relevance - (1 - self.relevance_weight) * redundancy
+
+            best = max(candidates, key=marginal_relevance)
+            candidates.remove(best)
+            text, _, words, tokens = best
+
+            if any(self._overlap(words, other) >= self.duplicate_threshold for other in chosen):
+                continue
+
+            for i in range(max_prompts):  # first prompt with room, so the most relevant chunks share the first prompt
+                needed = tokens + (separator_tokens if contexts[i] else 0)
+                if needed <= remaining[i]:
+                    contexts[i].append(text)
+                    remaining[i] -= needed
+                    chosen.append(words)
+                    break
+
+        return ["\n".join(context) for context in contexts if context]
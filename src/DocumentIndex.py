@@ -0,0 +1,406 @@
+import hashlib
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Callable
+
+from langchain.schema import Document
+from langchain.text_splitter import CharacterTextSplitter
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+from LexicalIndex import LexicalIndex
+from MemmapVectorStore import MemmapVectorStore
+from Metrics import metrics
+
+
+class DocumentIndex:
+    """
+    A vector and lexical index over the documents in doc/ that is persisted to disk, so
+    that the documents only need to be parsed and embedded again when they change.
+
+    The index directory holds the vector store and the BM25 lexical index alongside a
+    manifest recording the path, size, modification time, content hash and chunk ids of
+    every indexed file. The chunk ids let the chunks of a single file be replaced without
+    touching the rest of the index.
+
+    Backends:
+        "faiss": a FAISS store, loaded into memory in full.
+        "memmap": a MemmapVectorStore, whose embeddings are memory-mapped so processes share
+            them, searched exactly. Suited to corpora of up to tens of thousands of chunks.
+    """
+
+    MANIFEST_VERSION = 2
+    SEARCH_MODES = ("vector", "hybrid", "lexical")
+    BACKENDS = ("faiss", "memmap")
+
+    def __init__(self, embeddings, load_documents: Callable[[list[str]], list[Document]],
+                 index_dir: str = "index", chunk_size: int = 2000, chunk_overlap: int = 100, vectors: bool = True,
+                 backend: str = "faiss"):
+        """
+        Initialise the index, loading a previously saved index from index_dir if there is one.
+
+        :param embeddings: The embeddings used to embed the document chunks and queries.
+        :param load_documents: Loads a list of file paths into documents, with the file path as
+            their source. Files that fail to load are left out.
+        :param index_dir: The directory the index and its manifest are saved in.
+        :param chunk_size: The maximum size of each chunk in characters.
+        :param chunk_overlap: The overlap between consecutive chunks in characters.
+        :param vectors: Whether to embed the chunks into the vector store. Without it only
+            lexical search is available, and no embedding calls are made.
+        :param backend: The vector store, one of DocumentIndex.BACKENDS.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}. Please use one of {', '.join(self.BACKENDS)} in DocumentIndex class.")
+
+        self.embeddings = embeddings
+        self.load_documents = load_documents
+        self.index_dir = index_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.vectors = vectors
+        self.backend = backend
+        self.text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+        self.manifest: dict = {}
+        self._failed: dict[str, dict] = {}  # path -> entry of files that failed to load, retried once they change
+        self.vectorstore: "FAISS | MemmapVectorStore | None" = None
+        self.lexical = LexicalIndex()
+        self.version = 0  # incremented whenever the indexed documents change
+        self._lock = threading.RLock()
+        self._watcher: threading.Thread | None = None
+        self._stop_watching = threading.Event()
+
+        self._load()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    @property
+    def lexical_path(self) -> str:
+        return os.path.join(self.index_dir, "lexical.json")
+
+    @property
+    def memmap_dir(self) -> str:
+        return os.path.join(self.index_dir, "vectors")
+
+    def _settings(self) -> dict:
+        """
+        The settings the index was built with, a saved index is only reused if these match.
+        """
+        return {
+            "version": self.MANIFEST_VERSION,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "vectors": self.vectors,
+            "backend": self.backend,
+            "embedding_model": getattr(self.embeddings, "model", type(self.embeddings).__name__),
+        }
+
+    def _load(self):
+        """
+        Load the saved index and manifest from disk, if they exist and match the current settings.
+        """
+        try:
+            with open(self.manifest_path, "r") as fr:
+                manifest = json.load(fr)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        if manifest.get("settings") != self._settings():
+            print("Saved document index was built with different settings, it will be rebuilt.")
+            return
+
+        try:
+            if manifest.get("has_vectors") and self.backend == "memmap":
+                self.vectorstore = MemmapVectorStore.load(self.memmap_dir, self.embeddings)
+            elif manifest.get("has_vectors"):
+                from langchain_community.vectorstores import FAISS  # only needed once there are vectors
+
+                self.vectorstore = FAISS.load_local(
+                    self.index_dir, self.embeddings, allow_dangerous_deserialization=True
+                )
+            self.lexical = LexicalIndex.load(self.lexical_path)
+        except Exception as e:
+            print(f"Failed to load saved document index: {e}. It will be rebuilt.")
+            self.vectorstore = None
+            self.lexical = LexicalIndex()
+            return
+
+        self.manifest = manifest
+
+    def _save(self):
+        """
+        Save the index and its manifest to disk. The manifest is written last and replaced
+        atomically, so an interrupted save is detected as a stale index on the next load.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        if isinstance(self.vectorstore, MemmapVectorStore):
+            self.vectorstore.save()
+        elif self.vectorstore is not None:
+            self.vectorstore.save_local(self.index_dir)
+        self.lexical.save(self.lexical_path)
+
+        self.manifest["settings"] = self._settings()
+        self.manifest["has_vectors"] = self.vectorstore is not None
+
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as fw:
+            json.dump(self.manifest, fw, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        """
+        Compute the SHA-256 hash of a file's contents.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _file_entry(self, file_path: str) -> dict:
+        """
+        Describe a file on disk for the manifest. The content hash is only recomputed if the
+        size or modification time differ from the manifest, so an unchanged corpus costs one
+        stat call per file.
+
+        :param file_path: The path to the file.
+        :return: The manifest entry for the file, without its chunk ids.
+        """
+        stat = os.stat(file_path)
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+        previous = self.manifest.get("documents", {}).get(file_path) or self._failed.get(file_path)
+        if previous and previous["size"] == entry["size"] and previous["mtime"] == entry["mtime"]:
+            entry["sha256"] = previous["sha256"]
+        else:
+            entry["sha256"] = self._hash_file(file_path)
+        return entry
+
+    def _diff(self, file_paths: list[str]) -> tuple[dict[str, dict], list[str]]:
+        """
+        Compare the given files against the manifest.
+
+        :param file_paths: The files that should be indexed.
+        :return: The manifest entries of the files that were added or modified, and the paths
+            of the files that were removed.
+        """
+        documents = self.manifest.get("documents", {})
+        changed = {}
+        for file_path in file_paths:
+            entry = self._file_entry(file_path)
+            previous = documents.get(file_path)
+            if previous is None and self._failed.get(file_path, {}).get("sha256") == entry["sha256"]:
+                continue  # it failed to load and has not changed since
+            if previous is None or previous["sha256"] != entry["sha256"]:
+                changed[file_path] = entry
+            elif previous["mtime"] != entry["mtime"]:
+                previous["mtime"] = entry["mtime"]  # touched but not modified, skip rehashing next time
+
+        current = set(file_paths)
+        removed = [file_path for file_path in documents if file_path not in current]
+        for file_path in [file_path for file_path in self._failed if file_path not in current]:
+            del self._failed[file_path]
+        return changed, removed
+
+    def _update(self, changed: dict[str, dict], removed: list[str]) -> bool:
+        """
+        Remove the chunks of modified and removed files, then split and embed the added and
+        modified files, so that the work done is proportional to the number of changed files.
+        The lexical index is updated alongside the vector store.
+
+        Files that fail to load are left out of the manifest, so they are tried again once
+        they change or the index is reopened.
+
+        :param changed: The manifest entries of the files that were added or modified.
+        :param removed: The paths of the files that were removed.
+        :return: Whether the index changed.
+        """
+        documents = self.manifest.setdefault("documents", {})
+
+        stale_ids = []
+        dropped = 0
+        for file_path in [*removed, *changed]:
+            if file_path in documents:
+                stale_ids.extend(documents.pop(file_path)["chunk_ids"])
+                dropped += 1
+        if stale_ids and self.vectorstore is not None:
+            self.vectorstore.delete(stale_ids)
+        self.lexical.delete(stale_ids)
+
+        texts: list[str] = []
+        metadatas: list[dict] = []
+        ids: list[str] = []
+        if changed:
+            print(f"Indexing {len(changed)} changed files...")
+            loaded = {document.metadata["source"]: document for document in self.load_documents(list(changed))}
+            for file_path, entry in changed.items():
+                document = loaded.get(file_path)
+                if document is None:
+                    self._failed[file_path] = entry
+                    continue
+                self._failed.pop(file_path, None)
+                chunks = self.text_splitter.split_text(document.page_content)
+                entry["chunk_ids"] = [f"{file_path}:{i}" for i in range(len(chunks))]
+                documents[file_path] = entry
+
+                texts.extend(chunks)
+                metadatas.extend({"source": file_path} for _ in chunks)
+                ids.extend(entry["chunk_ids"])
+
+        if texts and self.vectors:
+            if self.vectorstore is None and self.backend == "memmap":
+                self.vectorstore = MemmapVectorStore.from_texts(self.memmap_dir, texts, self.embeddings,
+                                                                metadatas=metadatas, ids=ids)
+            elif self.vectorstore is None:
+                from langchain_community.vectorstores import FAISS
+
+                self.vectorstore = FAISS.from_texts(texts, self.embeddings, metadatas=metadatas, ids=ids)
+            else:
+                self.vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+        self.lexical.add_texts(texts, metadatas=metadatas, ids=ids)
+
+        if not dropped and all(file_path in self._failed for file_path in changed):
+            return False  # every file failed to load, and none were indexed before
+        self.version += 1
+        self._save()
+        return True
+
+    def refresh(self, file_paths: list[str]) -> bool:
+        """
+        Bring the index up to date with the given files, only re-embedding files that were
+        added or modified since the last refresh and dropping the chunks of removed files.
+
+        :param file_paths: The files that should be indexed.
+        :return: Whether the index changed.
+        """
+        file_paths = [os.path.normpath(file_path) for file_path in file_paths]
+        with self._lock:
+            changed, removed = self._diff(file_paths)
+            if not changed and not removed:
+                return False
+            with metrics.span("index_update"):
+                return self._update(changed, removed)
+
+    def watch(self, list_files: Callable[[], list[str]], interval: float = 2.0):
+        """
+        Start a background thread that polls for changes to the documents and refreshes the
+        index, so that new documents become searchable without waiting for the next query.
+
+        :param list_files: Returns the files that should currently be indexed.
+        :param interval: The number of seconds between polls.
+        """
+        if self._watcher is not None:
+            return
+
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch_loop, args=(list_files, interval), daemon=True)
+        self._watcher.start()
+
+    @property
+    def watching(self) -> bool:
+        """
+        Whether a background thread is keeping the index up to date.
+        """
+        return self._watcher is not None
+
+    def _watch_loop(self, list_files: Callable[[], list[str]], interval: float):
+        while not self._stop_watching.is_set():
+            try:
+                self.refresh(list_files())
+            except Exception as e:
+                print(f"Error refreshing the document index: {e}. Continuing...")
+            self._stop_watching.wait(interval)
+
+    def stop_watching(self):
+        """
+        Stop the background thread started by watch, if it is running.
+        """
+        if self._watcher is None:
+            return
+
+        self._stop_watching.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def similarity_search(self, query: str, k: int = 3) -> list[Document]:
+        """
+        Find the chunks most similar to the query, only the query itself is embedded.
+
+        :param query: The query to search for.
+        :param k: The number of chunks to return.
+        :return: The k most similar chunks.
+        """
+        with self._lock:
+            if self.vectorstore is None:
+                return []
+            return self.vectorstore.similarity_search(query, k=k)
+
+    def similarity_search_with_relevance(self, query: str, k: int = 3) -> list[tuple[Document, float]]:
+        """
+        Find the chunks most similar to the query, along with how relevant each one is.
+
+        :param query: The query to search for.
+        :param k: The number of chunks to return.
+        :return: The k most similar chunks and their relevance, higher is more relevant.
+        """
+        if self.vectorstore is None:
+            return []
+        query_vector = self.embeddings.embed_query(query)  # outside the lock, so searches from many calls overlap
+        with self._lock:
+            results = self.vectorstore.similarity_search_with_score_by_vector(query_vector, k=k)
+        return [(document, 1 / (1 + float(distance))) for document, distance in results]  # both backends score by L2 distance
+
+    def lexical_search(self, query: str, k: int = 3) -> list[tuple[Document, float]]:
+        """
+        Find the chunks that best match the query's terms with BM25, without embedding anything.
+
+        :param query: The query to search for.
+        :param k: The number of chunks to return.
+        :return: Up to k matching chunks and their BM25 scores, higher is more relevant.
+        """
+        with self._lock:
+            return self.lexical.search(query, k=k)
+
+    def hybrid_search(self, query: str, k: int = 3, rrf_k: int = 60) -> list[tuple[Document, float]]:
+        """
+        Find the chunks most relevant to the query by fusing the vector and lexical rankings
+        with reciprocal rank fusion, which needs no calibration between their scores.
+
+        :param query: The query to search for.
+        :param k: The number of chunks to return, and taken from each ranking.
+        :param rrf_k: Damps the weight of the top ranks, 60 is the usual choice.
+        :return: The k chunks with the highest fused scores, and their scores.
+        """
+        scores: dict[str, float] = {}
+        documents: dict[str, Document] = {}
+        for results in (self.similarity_search_with_relevance(query, k=k), self.lexical_search(query, k=k)):
+            for rank, (document, _) in enumerate(results):
+                key = document.id or document.page_content
+                documents.setdefault(key, document)
+                scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank + 1)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(documents[key], score) for key, score in ranked]
+
+    def search(self, query: str, k: int = 3, mode: str = "hybrid") -> list[tuple[Document, float]]:
+        """
+        Find the chunks most relevant to the query.
+
+        :param query: The query to search for.
+        :param k: The number of chunks to return.
+        :param mode: "vector" for embedding similarity, "lexical" for BM25 alone, which makes
+            no embedding call, or "hybrid" to fuse the two.
+        :return: The k most relevant chunks and their relevance, higher is more relevant.
+        """
+        if mode == "vector":
+            return self.similarity_search_with_relevance(query, k=k)
+        if mode == "lexical":
+            return self.lexical_search(query, k=k)
+        if mode == "hybrid":
+            return self.hybrid_search(query, k=k)
+        raise ValueError(f"Unknown mode: {mode}. Please use one of {', '.join(self.SEARCH_MODES)} in DocumentIndex class.")
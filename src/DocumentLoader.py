@@ -0,0 +1,241 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator
+
+from langchain.schema import Document
+
+
+def _pdf_pages(file_path: str, start: int, stop: int) -> Iterator[str]:
+    """
+    Yield the text of each page in [start, stop), releasing each page once it is read so
+    that long PDFs are not held in memory all at once.
+    """
+    import pdfplumber  # imported by the parsing processes, only once a PDF needs parsing
+
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            yield page.extract_text() or ""
+            page.close()
+
+
+def _word_paragraphs(file_path: str) -> Iterator[str]:
+    from docx import Document as DocxDocument
+
+    for para in DocxDocument(file_path).paragraphs:
+        yield para.text + "\n"
+
+
+def _extract_pdf(file_path: str, start: int, stop: int) -> str:
+    return "".join(_pdf_pages(file_path, start, stop))
+
+
+def _extract_word(file_path: str) -> str:
+    return "".join(_word_paragraphs(file_path))
+
+
+def _extract_text(file_path: str) -> str:
+    with open(file_path, "r", encoding="utf-8", errors="replace") as fr:
+        return fr.read()
+
+
+def _pdf_page_count(file_path: str) -> int:
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+class DocumentLoader:
+    """
+    Extracts the text of PDF, Word, text and Markdown files. Files are parsed in a pool of
+    processes, with long PDFs split into ranges of pages parsed in parallel, and the
+    extracted text is cached on disk so unchanged files are never parsed again.
+
+    Cached text is keyed by the file's path, size, modification time and content hash.
+
+    A file that is unsupported or fails to parse is skipped, so one bad file does not stop
+    the rest from loading. The parsing processes are started with forkserver, or spawn where
+    it is not available, since forking a process that runs the recording and API threads
+    can copy their locks in a held state.
+    """
+
+    EXTENSIONS = (".pdf", ".docx", ".txt", ".md")
+
+    def __init__(self, cache_dir: str | None = "cache/text", max_workers: int | None = None, pages_per_task: int = 20):
+        """
+        :param cache_dir: The directory the extracted text is cached in, None to disable the cache.
+        :param max_workers: The number of parsing processes, defaults to the number of CPUs.
+        :param pages_per_task: The number of PDF pages parsed by each process at a time.
+        """
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+
+        self._hashes: dict[str, tuple[int, int, str]] = {}  # path -> size, mtime and hash when last hashed
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _cache_key(self, file_path: str) -> str:
+        """
+        The key for the file's current contents. The file is only rehashed if its size or
+        modification time changed since it was last hashed.
+        """
+        stat = os.stat(file_path)
+        known = self._hashes.get(file_path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            file_hash = known[2]
+        else:
+            sha256 = hashlib.sha256()
+            with open(file_path, "rb") as fr:
+                for block in iter(lambda: fr.read(1 << 20), b""):
+                    sha256.update(block)
+            file_hash = sha256.hexdigest()
+            self._hashes[file_path] = (stat.st_size, stat.st_mtime_ns, file_hash)
+
+        key = f"{os.path.abspath(file_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{file_hash}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _read_cache(self, key: str) -> str | None:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, key + ".txt"), "r", encoding="utf-8") as fr:
+                return fr.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, key: str, text: str):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, key + ".txt")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fw:
+            fw.write(text)
+        os.replace(tmp_path, path)
+
+    def _tasks(self, file_path: str) -> list[tuple]:
+        """
+        The parsing tasks for a file, as a function and its arguments. A PDF is split into one
+        task per range of pages.
+        """
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension == ".pdf":
+            page_count = _pdf_page_count(file_path)
+            return [
+                (_extract_pdf, file_path, start, min(start + self.pages_per_task, page_count))
+                for start in range(0, page_count, self.pages_per_task)
+            ]
+        if extension == ".docx":
+            return [(_extract_word, file_path)]
+        return [(_extract_text, file_path)]
+
+    def _run(self, tasks: list[tuple]) -> list[str | Exception]:
+        """
+        Run the tasks, in the process pool if there is more than one of them.
+
+        :return: The result of each task in the same order, or the exception it raised.
+        """
+        if len(tasks) == 1:
+            function, *args = tasks[0]
+            try:
+                return [function(*args)]
+            except Exception as e:
+                return [e]
+
+        results = self._submit(tasks)
+        broken = [i for i, result in enumerate(results) if isinstance(result, BrokenProcessPool)]
+        if broken:
+            # a dying process fails every task still in the pool, so each one is run again on
+            # its own, and only the task that kills its process is reported as failed
+            print(f"A parsing process died, retrying {len(broken)} tasks one at a time...")
+            for i in broken:
+                results[i] = self._submit([tasks[i]])[0]
+        return results
+
+    def _submit(self, tasks: list[tuple]) -> list[str | Exception]:
+        """
+        Run the tasks in the process pool. If a parsing process dies, such as when a PDF runs it
+        out of memory, the pool is broken for good, so it is shut down and replaced on the next call.
+        """
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            executor = self._executor
+        try:
+            futures = [executor.submit(function, *args) for function, *args in tasks]
+            results = [future.exception() or future.result() for future in futures]
+        except BrokenProcessPool as e:  # broken by another thread's tasks since it was created
+            results = [e for _ in tasks]
+
+        if any(isinstance(result, BrokenProcessPool) for result in results):
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def load(self, file_paths: list[str]) -> list[Document]:
+        """
+        Load the files into documents, parsing only the files whose text is not already cached.
+        Files that are unsupported or fail to parse are logged and left out.
+
+        :param file_paths: The files to load.
+        :return: The documents of the files that were loaded, in the same order, with the file
+            path as their source.
+        """
+        texts: dict[str, str] = {}
+        keys: dict[str, str] = {}
+        tasks: list[tuple] = []
+        task_files: list[str] = []
+        for file_path in file_paths:
+            if not file_path.lower().endswith(self.EXTENSIONS):
+                print(f"Skipping {file_path}: unsupported file format.")
+                continue
+            try:
+                keys[file_path] = self._cache_key(file_path)
+                cached_text = self._read_cache(keys[file_path])
+                file_tasks = [] if cached_text is not None else self._tasks(file_path)
+            except Exception as e:
+                print(f"Skipping {file_path}: {e}")
+                continue
+            if cached_text is not None:
+                texts[file_path] = cached_text
+            elif not file_tasks:  # a PDF without pages
+                texts[file_path] = ""
+            for task in file_tasks:
+                tasks.append(task)
+                task_files.append(file_path)
+
+        if tasks:
+            print(f"Parsing {len(set(task_files))} documents...")
+            parts: dict[str, list[str | Exception]] = {}
+            for file_path, part in zip(task_files, self._run(tasks)):
+                parts.setdefault(file_path, []).append(part)
+            for file_path, file_parts in parts.items():
+                errors = [part for part in file_parts if isinstance(part, Exception)]
+                if errors:
+                    print(f"Skipping {file_path}: failed to parse it: {errors[0]}")
+                    continue
+                texts[file_path] = "".join(file_parts)
+                self._write_cache(keys[file_path], texts[file_path])
+
+        return [
+            Document(page_content=texts[file_path], metadata={"source": file_path})
+            for file_path in file_paths if file_path in texts
+        ]
+
+    def close(self):
+        """
+        Shut down the parsing processes, if they were started.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
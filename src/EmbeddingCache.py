@@ -0,0 +1,163 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from Metrics import metrics
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings object with a content-addressed cache, so that a text is only sent
+    to the embedding model the first time it is seen.
+
+    Vectors are looked up in an in-memory LRU first, then in an SQLite store on disk that
+    persists between sessions. Both are keyed by a hash of the model name and the text.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_dir: str = "cache",
+                 max_memory_entries: int = 10000, max_disk_entries: int = 200000):
+        """
+        :param embeddings: The embeddings object to cache.
+        :param cache_dir: The directory the on-disk store is kept in, None to only cache in memory.
+        :param max_memory_entries: The maximum number of vectors kept in memory.
+        :param max_disk_entries: The maximum number of vectors kept on disk, the least recently
+            used vectors are evicted beyond this.
+        """
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(cache_dir, "embeddings.sqlite"), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """
+        Add a vector to the in-memory LRU, evicting the least recently used vectors beyond the cap.
+        """
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _get(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """
+        Look up the given keys in memory and then on disk, updating the hit and miss counters.
+
+        :param keys: The unique keys to look up.
+        :return: The vectors that were found, by key.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                self._memory.move_to_end(key)
+                found[key] = vector
+        self.memory_hits += len(found)
+
+        if missing and self._db is not None:
+            placeholders = ",".join("?" * len(missing))
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing
+            ).fetchall()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                found[key] = vector
+                self._remember(key, vector)
+            if rows:
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = julianday('now') WHERE key = ?", [(key,) for key, _ in rows]
+                )
+                self._db.commit()
+            self.disk_hits += len(rows)
+
+        self.misses += len(keys) - len(found)
+        return found
+
+    def _put(self, vectors: dict[str, np.ndarray]):
+        """
+        Store newly computed vectors in memory and on disk.
+        """
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+
+        if self._db is not None:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, julianday('now'))",
+                [(key, vector.tobytes()) for key, vector in vectors.items()]
+            )
+            (count,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_disk_entries:
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_disk_entries,)
+                )
+            self._db.commit()
+
+    def _embed(self, kind: str, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        with self._lock:
+            found = self._get(list(dict.fromkeys(keys)))
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            with metrics.span("embed"):
+                if kind == "query":
+                    computed = [self.embeddings.embed_query(text) for text in missing.values()]
+                else:
+                    computed = self.embeddings.embed_documents(list(missing.values()))
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, computed)}
+            with self._lock:
+                self._put(computed)
+            found.update(computed)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a list of documents, only sending the ones that are not cached to the model.
+        """
+        return self._embed("document", texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Embed a query, reusing the cached vector if the same query has been embedded before.
+        """
+        return self._embed("query", [text])[0]
+
+    def stats(self) -> dict:
+        """
+        The cache hit and miss counters, and the number of vectors held in memory.
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+            }
@@ -1,127 +1,152 @@
 from dotenv import load_dotenv
+import asyncio
 import os
+import threading
+from typing import Callable, Iterator
 from langchain_openai import OpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain.schema import Document
-from langchain.text_splitter import CharacterTextSplitter
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-import pdfplumber
-from docx import Document as DocxDocument
+
+from ApiClient import ApiClient
+from ContextPacker import ContextPacker, TokenCounter
+from DocumentIndex import DocumentIndex
+from DocumentLoader import DocumentLoader
+from EmbeddingCache import CachedEmbeddings
+from MicroBatcher import BatchedEmbeddings
+from Metrics import metrics
+from MetricsCallback import MetricsCallbackHandler
+from SemanticCache import SemanticCache
+from SentenceRanker import SentenceRanker
 
 class LLMQuery:
-    def __init__(self):
+    def __init__(self, ranking_mode: str = "llm", max_concurrency: int = 4, request_timeout: float = 30.0,
+                 prompt_token_budget: int = 3000, fetch_k: int = 8, max_prompts: int = 1,
+                 retrieval_mode: str = "hybrid", embeddings: Embeddings | None = None,
+                 api_client: ApiClient | None = None, max_batch_size: int = 16, max_batch_wait: float = 0.01,
+                 vector_backend: str = "faiss"):
+        """
+        :param ranking_mode: How suggested sentences are ranked, see SentenceRanker.MODES.
+        :param max_concurrency: The maximum number of context chunks sent to the LLM at once.
+        :param request_timeout: The number of seconds to wait for each LLM request.
+        :param prompt_token_budget: The maximum number of tokens in each prompt, including the context.
+        :param fetch_k: The number of chunks retrieved as candidates for the context.
+        :param max_prompts: The number of prompts the retrieved context may be spread over.
+        :param retrieval_mode: How context chunks are retrieved, see DocumentIndex.SEARCH_MODES. In
+            "lexical" mode the documents are never embedded and queries make no embedding call.
+        :param embeddings: The embeddings for the document chunks and cache keys, defaults to OpenAI's.
+        :param api_client: The connection pool and retry policy for API requests, shared with the
+            transcriber. A new one is created if not given.
+        :param max_batch_size: The largest number of query embeddings or ranking prompts that
+            concurrent calls coalesce into one request.
+        :param max_batch_wait: The longest time in seconds a query embedding or ranking prompt
+            waits for others to join its request, 0 to only batch requests that are already waiting.
+        :param vector_backend: The store for the chunk embeddings, see DocumentIndex.BACKENDS.
+        """
         load_dotenv()
         openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.llm = OpenAI(api_key=openai_api_key)
-        self.embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.prompt_token_budget = prompt_token_budget
+        self.fetch_k = fetch_k
+        self.max_prompts = max_prompts
+        if retrieval_mode not in DocumentIndex.SEARCH_MODES:
+            raise ValueError(f"Unknown mode: {retrieval_mode}. Please use one of {', '.join(DocumentIndex.SEARCH_MODES)} in LLMQuery class.")
+        self.retrieval_mode = retrieval_mode
+        self.api_client = api_client or ApiClient(timeout=request_timeout)
+        self.llm = OpenAI(api_key=openai_api_key, callbacks=[MetricsCallbackHandler(metrics)],
+                          **self.api_client.langchain_kwargs(timeout=request_timeout))
+        self.token_counter = TokenCounter(model=self.llm.model_name)
+        self.packer = ContextPacker(self.token_counter)
+        if embeddings is None:
+            embeddings = BatchedEmbeddings(
+                OpenAIEmbeddings(api_key=openai_api_key, **self.api_client.langchain_kwargs()),
+                max_batch_size=max_batch_size, max_wait=max_batch_wait
+            )
+        self.embeddings = CachedEmbeddings(embeddings, cache_dir="cache")  # only cache misses reach the batcher
+        self.ranker = SentenceRanker(self.llm, self.embeddings, mode=ranking_mode,
+                                     max_batch_size=max_batch_size, max_batch_wait=max_batch_wait)
+        self.loader = DocumentLoader(cache_dir="cache/text")
+        self.index = DocumentIndex(self.embeddings, self._load_documents, index_dir="index",
+                                   vectors=retrieval_mode != "lexical", backend=vector_backend)
+        self.response_cache = SemanticCache()
 
-    def _load_pdf(self, file_path: str) -> str:
+    def watch_documents(self, list_files: Callable[[], list[str]], interval: float = 2.0):
         """
-        Extract text from a PDF file.
-        """
-        text = ""
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-        return text
+        Keep the document index up to date in the background, so that documents added to
+        doc/ mid-call are indexed before the next query instead of during it.
 
-    def _load_word(self, file_path: str) -> str:
-        """
-        Extract text from a Word file.
+        :param list_files: Returns the files that should currently be indexed.
+        :param interval: The number of seconds between checks for changed files.
         """
-        doc = DocxDocument(file_path)
-        text = ""
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        return text
+        self.index.watch(list_files, interval)
 
-    def _load_documents(self, file_paths: list[str]) -> list[Document]:
+    def warm_up(self, file_paths: list[str] | None = None) -> threading.Thread:
         """
-        Load documents from a list of file paths (PDF and Word).
+        Do the slow parts of the first query in a background thread, so they are done before
+        it arrives: open a connection to the API, load the tokenizer, and bring the document
+        index up to date unless watch_documents already keeps it so.
+
+        :param file_paths: The files that should be indexed, None to leave the index as it is.
+        :return: The warm-up thread.
         """
-        documents = []
-        for file_path in file_paths:
-            if file_path.lower().endswith('.pdf'):
-                content = self._load_pdf(file_path)
-            elif file_path.lower().endswith('.docx'):
-                content = self._load_word(file_path)
-            else:
-                raise ValueError(f"Unsupported file format: {file_path}")
+        def run():
+            try:
+                with metrics.span("warm_up"):
+                    self.api_client.warm_up(self.llm.openai_api_base)
+                    self.token_counter.count("")
+                    if file_paths is not None:
+                        self._refresh_index(file_paths)
+            except Exception as e:
+                print(f"Error warming up: {e}. The first query will do it instead.")
 
-            documents.append(Document(page_content=content))
-        return documents
+        thread = threading.Thread(target=run, name="warm-up", daemon=True)
+        thread.start()
+        return thread
 
-    def _split_and_embed_documents(self, documents: list[Document]) -> FAISS:
+    def stop(self):
         """
-        Split documents into smaller chunks and embed them into a vector store.
+        Stop any background work started by this instance.
         """
-        text_splitter = CharacterTextSplitter(chunk_size=2000, chunk_overlap=100)
-        chunks = [text_splitter.split_text(doc.page_content) for doc in documents]
-        flat_chunks = [chunk for sublist in chunks for chunk in sublist]
-        doc_vectors = FAISS.from_texts(flat_chunks, self.embeddings)
-        return doc_vectors
+        self.index.stop_watching()
+        self.loader.close()
+        self.ranker.close()
+        if isinstance(self.embeddings.embeddings, BatchedEmbeddings):
+            self.embeddings.embeddings.close()
 
-    def _split_context(self, context: str, max_chunk_size: int = 2000) -> list[str]:
+    def _load_documents(self, file_paths: list[str]) -> list[Document]:
         """
-        Split the context into smaller chunks to avoid exceeding the token limit.
-
-        :param context: The full context text to split.
-        :param max_chunk_size: Maximum allowed size for each chunk in words.
-        :return: A list of context chunks.
+        Load documents from a list of file paths (PDF, Word, text and Markdown).
         """
-        words = context.split()
-        chunks = [words[i:i + max_chunk_size] for i in range(0, len(words), max_chunk_size)]
-        return [" ".join(chunk) for chunk in chunks]
+        with metrics.span("load_documents"):
+            return self.loader.load(file_paths)
 
     def _estimate_token_count(self, text: str) -> int:
         """
-        Estimate the token count of a given text.
+        Count the tokens in a given text with the LLM's tokenizer.
         """
-        return len(text) // 4
+        return self.token_counter.count(text)
 
     def _rank_sentences(self, responses: list[str], query: str) -> str:
         """
-        Rank sentences based on relevance to the query by passing the sentences to the LLM 
-        with the query and a prompt to assess their fit.
+        Rank sentences based on relevance to the query, scoring every sentence in a single
+        pass with the ranker selected by ranking_mode.
 
         :param responses: A list of response texts.
         :param query: The user query for context.
-        :return: A single string with the top sentences ranked by relevance.
+        :return: A single string with the top sentences ranked by relevance, empty if there are none.
         """
         all_sentences = []
         for response in responses:
             sentences = response.split('. ')
-            all_sentences.extend(sentences)
-
-        ranking_prompt_template = (
-            "Query:\n{query}\n\n"
-            "Sentence:\n{sentence}\n\n"
-            "Rate the relevance of the sentence to the query on a scale of 1 to 10, "
-            "where 10 means highly relevant and 1 means not relevant at all. Just provide the rating."
-        )
-        ranking_prompt = PromptTemplate(
-            template=ranking_prompt_template,
-            input_variables=["query", "sentence"]
-        )
-
-        scored_sentences = []
-        for sentence in all_sentences:
-            if not sentence.strip():  # incase there are any empty sentences
-                continue
-
-           
-            chain = ranking_prompt | self.llm
-            rating_response = chain.invoke({"query": query, "sentence": sentence})
-
-            # attempt to parse as an integer
-            try:
-                rating = int(rating_response.strip())
-            except ValueError:
-                rating = 0  # if parsing fails
-
-            scored_sentences.append((rating, sentence))
+            all_sentences.extend(sentence for sentence in sentences if sentence.strip())  # incase there are any empty sentences
+        if not all_sentences:
+            return ""
 
+        with metrics.span("rank"):
+            scores = self.ranker.score(all_sentences, query)
+        scored_sentences = list(zip(scores, all_sentences))
         scored_sentences.sort(reverse=True, key=lambda x: x[0])
 
         # top 3 sentences for now
@@ -129,72 +154,224 @@ class LLMQuery:
 
         return '.\n'.join(top_sentences) + '.\n'
 
+    @staticmethod
+    def _prompt(few_shot_prompts: list[str]) -> PromptTemplate:
+        prompt_template = "\n".join(few_shot_prompts) + "\n\nContext:\n{context}\n\nQuery:\n{query}\n\nAnswer:"
+        return PromptTemplate(
+            template=prompt_template,
+            input_variables=["context", "query"]
+        )
 
+    def query_token_budget(self, few_shot_prompts: list[str] | None = None) -> int:
+        """
+        The number of tokens a query can take up before it no longer fits in a prompt, leaving
+        no room for context.
 
+        :param few_shot_prompts: The few-shot examples the query will be sent with.
+        """
+        return self.prompt_token_budget - self._estimate_token_count(self._prompt(few_shot_prompts or []).format(context="", query=""))
 
-    def generate_query(self, file_paths: list[str], few_shot_prompts: list[str], query: str) -> str:
+    def _prepare_prompts(self, file_paths: list[str], few_shot_prompts: list[str], query: str) -> tuple[PromptTemplate, list[str]]:
         """
-        Generate a query using the provided documents (PDF and Word files), few-shot prompts, and user query.
+        Retrieve the context for the query and pack it into the contexts that will each be sent
+        to the LLM, filling each prompt up to prompt_token_budget tokens.
 
         :param file_paths: List of file paths to the documents. If empty, only few-shot prompts and query will be used.
         :param few_shot_prompts: List of few-shot examples to guide the model.
         :param query: The user query for which we want to generate a response.
-        :return: The response generated by the LLM.
+        :return: The prompt template, and the context to fill it with for each LLM call, in order.
         """
-        context = ""
+        prompt = self._prompt(few_shot_prompts)
 
-        
+        prompt_tokens = self._estimate_token_count(prompt.format(context="", query=query))
+        context_budget = self.prompt_token_budget - prompt_tokens
+        if context_budget < 0:
+            print(f"Skipping query due to exceeding token limit: {prompt_tokens} tokens.")
+            return prompt, []
+
+        contexts = [""]
         if file_paths:
-            documents = self._load_documents(file_paths)
-            if documents:
-                doc_vectors = self._split_and_embed_documents(documents)
-                retrieved_chunks: list[Document] = doc_vectors.similarity_search(query, k=3)
-                context = "\n".join([chunk.page_content for chunk in retrieved_chunks])
-                context_chunks = self._split_context(context, max_chunk_size=2000)
+            self._refresh_index(file_paths)
+            with metrics.span("retrieve"):
+                retrieved_chunks = self.index.search(query, k=self.fetch_k, mode=self.retrieval_mode)
+            if retrieved_chunks:
+                scored_chunks = [(chunk.page_content, relevance) for chunk, relevance in retrieved_chunks]
+                contexts = self.packer.pack(scored_chunks, context_budget, max_prompts=self.max_prompts) or [""]
             else:
                 print("Failed to load content from the provided documents.")
-        else:
-            context_chunks = [""]
 
+        return prompt, contexts
 
-        prompt_template = "\n".join(few_shot_prompts) + "\n\nContext:\n{context}\n\nQuery:\n{query}\n\nAnswer:"
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "query"]
+    def _refresh_index(self, file_paths: list[str]):
+        """
+        Bring the index up to date with the given files, unless it is being watched, in which
+        case the watcher keeps it up to date and queries only read it.
+        """
+        if file_paths and not self.index.watching:
+            self.index.refresh(file_paths)
+
+    def _lookup_response(self, file_paths: list[str], cache_key: str | None,
+                         cache_scope: str | None = None) -> tuple[list[float] | None, tuple, str | None]:
+        """
+        Look up a cached response for the conversational state described by cache_key.
+
+        :param file_paths: List of file paths to the documents, brought up to date first so the
+            index version is current.
+        :param cache_key: Text describing the conversational state, None to skip the cache. The
+            cache is also skipped in lexical retrieval mode, since the key would need embedding.
+        :param cache_scope: Only responses cached under the same scope are returned, such as
+            the id of the call, so responses are never shared between calls. None shares them
+            with every other caller that passes None.
+        :return: The embedding of the key, the index version and scope, and the cached response if there is one.
+        """
+        self._refresh_index(file_paths)
+        version = (self.index.version, cache_scope)
+        if cache_key is None or self.retrieval_mode == "lexical":
+            return None, version, None
+
+        key_vector = self.embeddings.embed_query(cache_key)
+        return key_vector, version, self.response_cache.get(key_vector, version)
+
+    def generate_query(self, file_paths: list[str], few_shot_prompts: list[str], query: str,
+                       cache_key: str | None = None, cache_scope: str | None = None) -> str:
+        """
+        Generate a query using the provided documents (PDF and Word files), few-shot prompts, and user query.
+        The context chunks are sent to the LLM concurrently, up to max_concurrency at a time.
+
+        :param file_paths: List of file paths to the documents. If empty, only few-shot prompts and query will be used.
+        :param few_shot_prompts: List of few-shot examples to guide the model.
+        :param query: The user query for which we want to generate a response.
+        :param cache_key: Text describing the conversational state, such as the latest few utterances. If
+            given, a response cached for a similar enough key is returned instead of generating one.
+        :param cache_scope: Keeps cached responses apart, such as the id of the call they were generated for.
+        :return: The response generated by the LLM.
+        """
+        key_vector, version, cached_response = self._lookup_response(file_paths, cache_key, cache_scope)
+        if cached_response is not None:
+            return cached_response
+
+        prompt, contexts = self._prepare_prompts(file_paths, few_shot_prompts, query)
+
+        chain = prompt | self.llm
+        results = chain.batch(
+            [{"context": context, "query": query} for context in contexts],
+            config={"max_concurrency": self.max_concurrency},
+            return_exceptions=True
         )
 
         responses = []
-        
-        for chunk in context_chunks:
-            estimated_tokens = self._estimate_token_count(chunk + query + "".join(few_shot_prompts))
-            
-            if estimated_tokens > 4000:
-                sub_chunks = self._split_context(chunk, max_chunk_size=2000)
-                partial_response = ""
-                
-                for sub_chunk in sub_chunks:
-                    estimated_sub_tokens = self._estimate_token_count(sub_chunk + query + "".join(few_shot_prompts))
-                    
-                    if estimated_sub_tokens > 4000:
-                        print(f"Skipping sub-chunk due to exceeding token limit: {estimated_sub_tokens} tokens.")
-                        continue
-                    
-                    chain = prompt | self.llm
-                    response = chain.invoke({"context": sub_chunk, "query": query})
-                    responses.append(response)
-                    partial_response += response + " "
-                
-                
-                responses.append(partial_response.strip())
-            else:
-                # If the chunk is within the token limit, process it as usual.
-                chain = prompt | self.llm
-                response = chain.invoke({"context": chunk, "query": query})
-                responses.append(response)
+        for result in results:  # batch keeps the results in the same order as the chunks
+            if isinstance(result, Exception):
+                print(f"Skipping chunk due to a failed request: {result}")
+                continue
+            responses.append(result)
 
         combined_response = self._rank_sentences(responses, query)
+        if key_vector is not None and combined_response:  # an empty response is never served again
+            self.response_cache.put(key_vector, version, combined_response)
         return combined_response
 
+    async def agenerate_query(self, file_paths: list[str], few_shot_prompts: list[str], query: str,
+                              cache_key: str | None = None, cache_scope: str | None = None) -> str:
+        """
+        Asynchronous version of generate_query. Every context chunk is dispatched at once, with
+        at most max_concurrency requests in flight, and any request that takes longer than
+        request_timeout seconds is dropped instead of holding up the rest.
+
+        :param file_paths: List of file paths to the documents. If empty, only few-shot prompts and query will be used.
+        :param few_shot_prompts: List of few-shot examples to guide the model.
+        :param query: The user query for which we want to generate a response.
+        :param cache_key: Text describing the conversational state, such as the latest few utterances. If
+            given, a response cached for a similar enough key is returned instead of generating one.
+        :param cache_scope: Keeps cached responses apart, such as the id of the call they were generated for.
+        :return: The response generated by the LLM.
+        """
+        key_vector, version, cached_response = await asyncio.to_thread(self._lookup_response, file_paths, cache_key, cache_scope)
+        if cached_response is not None:
+            return cached_response
+
+        prompt, contexts = await asyncio.to_thread(self._prepare_prompts, file_paths, few_shot_prompts, query)
+
+        chain = prompt | self.llm
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def invoke(context: str) -> str | None:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(
+                        chain.ainvoke({"context": context, "query": query}), timeout=self.request_timeout
+                    )
+                except asyncio.TimeoutError:
+                    print(f"Skipping chunk due to exceeding the {self.request_timeout} second timeout.")
+                except Exception as e:
+                    print(f"Skipping chunk due to a failed request: {e}")
+                return None
+
+        # gather returns the results in the same order as the chunks, regardless of completion order
+        results = await asyncio.gather(*(invoke(context) for context in contexts))
+        responses = [response for response in results if response is not None]
+
+        combined_response = await asyncio.to_thread(self._rank_sentences, responses, query)
+        if key_vector is not None and combined_response:  # an empty response is never served again
+            self.response_cache.put(key_vector, version, combined_response)
+        return combined_response
+
+    def stream_query(self, file_paths: list[str], few_shot_prompts: list[str], query: str,
+                     max_suggestions: int = 3, cache_key: str | None = None,
+                     cache_scope: str | None = None) -> Iterator[str]:
+        """
+        Streaming version of generate_query, which yields each line of the response as soon as
+        the LLM has finished writing it, so the first suggestion can be shown before the rest
+        have been generated. The lines are yielded in the order they are written rather than
+        being ranked, since ranking needs every sentence up front.
+
+        :param file_paths: List of file paths to the documents. If empty, only few-shot prompts and query will be used.
+        :param few_shot_prompts: List of few-shot examples to guide the model.
+        :param query: The user query for which we want to generate a response.
+        :param max_suggestions: The number of lines to yield before the stream is closed.
+        :param cache_key: Text describing the conversational state, such as the latest few utterances. If
+            given, a response cached for a similar enough key is returned instead of generating one.
+        :param cache_scope: Keeps cached responses apart, such as the id of the call they were generated for.
+        :return: An iterator over the lines of the response.
+        """
+        key_vector, version, cached_response = self._lookup_response(file_paths, cache_key, cache_scope)
+        if cached_response is not None:
+            yield from cached_response.splitlines()
+            return
+
+        lines = []
+        for line in self._stream_lines(file_paths, few_shot_prompts, query, max_suggestions):
+            lines.append(line)
+            yield line
+
+        # only reached if the stream wasn't closed early, so partial responses are never cached
+        if key_vector is not None and lines:
+            self.response_cache.put(key_vector, version, "\n".join(lines))
+
+    def _stream_lines(self, file_paths: list[str], few_shot_prompts: list[str], query: str,
+                      max_suggestions: int) -> Iterator[str]:
+        prompt, contexts = self._prepare_prompts(file_paths, few_shot_prompts, query)
+        chain = prompt | self.llm
+
+        suggestions = 0
+        for context in contexts:
+            buffer = ""
+            for token in chain.stream({"context": context, "query": query}):
+                buffer += token
+                *lines, buffer = buffer.split("\n")  # keep the unfinished line in the buffer
+                for line in lines:
+                    if line.strip():
+                        yield line.strip()
+                        suggestions += 1
+                        if suggestions >= max_suggestions:
+                            return
+
+            if buffer.strip():
+                yield buffer.strip()
+                suggestions += 1
+                if suggestions >= max_suggestions:
+                    return
+
 
 if __name__ == "__main__":
     llm_query_rag = LLMQuery()
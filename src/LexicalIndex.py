@@ -0,0 +1,129 @@
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from langchain.schema import Document
+
+
+class LexicalIndex:
+    """
+    An inverted index over the document chunks, scored with BM25. It runs locally with no
+    embedding call, and matches exact product names and figures that embeddings blur.
+
+    Terms are lower-cased words, with numbers such as 2,400 or 3.5 kept as single terms.
+    """
+
+    TERM_PATTERN = re.compile(r"\w+(?:[.,]\d+)*")
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        :param k1: How quickly repeated occurrences of a term stop adding to the score.
+        :param b: How strongly scores are normalised by chunk length, between 0 and 1.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, dict[str, int]] = {}  # term -> chunk id -> term frequency
+        self.chunks: dict[str, tuple[str, dict, int]] = {}  # chunk id -> text, metadata, length in terms
+        self.total_length = 0
+
+    @classmethod
+    def tokenize(cls, text: str) -> list[str]:
+        return cls.TERM_PATTERN.findall(text.lower())
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add_texts(self, texts: list[str], metadatas: list[dict], ids: list[str]):
+        """
+        Add chunks to the index.
+
+        :param texts: The text of each chunk.
+        :param metadatas: The metadata of each chunk.
+        :param ids: The id of each chunk.
+        """
+        for text, metadata, chunk_id in zip(texts, metadatas, ids):
+            terms = Counter(self.tokenize(text))
+            length = sum(terms.values())
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+            self.chunks[chunk_id] = (text, metadata, length)
+            self.total_length += length
+
+    def delete(self, ids: list[str]):
+        """
+        Remove chunks from the index.
+
+        :param ids: The ids of the chunks to remove, unknown ids are ignored.
+        """
+        for chunk_id in ids:
+            chunk = self.chunks.pop(chunk_id, None)
+            if chunk is None:
+                continue
+            text, _, length = chunk
+            self.total_length -= length
+            for term in set(self.tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int = 3) -> list[tuple[Document, float]]:
+        """
+        Find the chunks that best match the query's terms.
+
+        :param query: The query to search for.
+        :param k: The number of chunks to return.
+        :return: Up to k chunks that contain at least one query term, and their BM25 scores.
+        """
+        if not self.chunks:
+            return []
+
+        average_length = self.total_length / len(self.chunks)
+        scores: dict[str, float] = {}
+        for term in set(self.tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.chunks) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                length = self.chunks[chunk_id][2]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        results = []
+        for chunk_id, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            text, metadata, _ = self.chunks[chunk_id]
+            results.append((Document(page_content=text, metadata=metadata, id=chunk_id), score))
+        return results
+
+    def save(self, path: str):
+        """
+        Save the chunks to a JSON file, the postings are rebuilt from them on load.
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as fw:
+            json.dump({chunk_id: [text, metadata] for chunk_id, (text, metadata, _) in self.chunks.items()}, fw)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "LexicalIndex":
+        """
+        Load an index saved with save.
+
+        :param path: The file the index was saved to.
+        :return: The loaded index.
+        """
+        with open(path, "r") as fr:
+            chunks = json.load(fr)
+
+        index = cls(**kwargs)
+        index.add_texts(
+            [text for text, _ in chunks.values()],
+            [metadata for _, metadata in chunks.values()],
+            list(chunks)
+        )
+        return index
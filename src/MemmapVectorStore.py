@@ -0,0 +1,372 @@
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from langchain.schema import Document
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where the store is only safe to use from one process
+    fcntl = None
+
+
+class MemmapVectorStore:
+    """
+    A vector store kept in a directory of flat files, for corpora small enough that an exact
+    search over every chunk is fast. The embeddings and their squared norms are contiguous
+    float32 .npy files that are memory-mapped read-only rather than read, so processes serving
+    calls from the same index share one copy in the page cache, and opening the store only
+    reads its chunk list.
+
+    The directory holds:
+        vectors-<generation>.npy: the embeddings, one row per chunk, with spare rows to append to.
+        norms-<generation>.npy: the squared norm of each row of the embeddings.
+        texts-<generation>.bin: the chunk texts, UTF-8 encoded one after another.
+        chunks.json: the generation, the number of rows, and each row's id, metadata, text
+            offset and whether it was deleted. It is replaced atomically once the other files
+            are written, so an interrupted update leaves the previous state intact.
+
+    The store can be shared between processes. Added and deleted chunks are kept in memory
+    until save, which takes an exclusive lock on the directory, reloads chunks.json to pick
+    up what other processes saved, and then applies the changes on top of it. Rows are only
+    appended past the last committed row, so readers of the committed state are unaffected,
+    and when the files are full or most of their rows are deleted, the live rows are copied
+    into a new generation instead. Opening the store takes a shared lock, so the files of an
+    older generation are never removed while they are being opened.
+
+    Search computes the squared L2 distance to every row with one matrix-vector product and
+    picks the top k with argpartition, the same distances a flat FAISS index returns.
+    """
+
+    META_FILE = "chunks.json"
+    LOCK_FILE = ".lock"
+    KINDS = {"vectors": "npy", "norms": "npy", "texts": "bin"}
+
+    def __init__(self, directory: str, embeddings):
+        """
+        Open the store in a directory, loading it if one was saved there.
+
+        :param directory: The directory the store's files are kept in.
+        :param embeddings: The embeddings used to embed added texts and queries.
+        """
+        self.directory = directory
+        self.embeddings = embeddings
+
+        # the committed state, as of the last load or save
+        self.generation = 0
+        self.count = 0  # committed rows, deleted or not
+        self.vectors: np.memmap | None = None
+        self.norms: np.memmap | None = None
+        self.live = np.empty(0, dtype=bool)
+        self.ids: list[str] = []
+        self.metadatas: list[dict] = []
+        self.offsets = [0]  # row i's text is texts[offsets[i]:offsets[i + 1]]
+        self._texts = None  # kept open, so a generation removed by another process can still be read
+        self._texts_lock = threading.Lock()
+
+        # changes that are not saved yet; pending rows are numbered on from the committed ones
+        self._pending_vectors: np.ndarray | None = None
+        self._pending_live = np.empty(0, dtype=bool)
+        self._pending_texts: list[str] = []
+        self._pending_ids: list[str] = []
+        self._pending_metadatas: list[dict] = []
+        self._deleted_ids: set[str] = set()  # committed chunks deleted since the last save
+
+        self._rows: dict[str, int] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        with self._locked(exclusive=False):
+            self._load()
+
+    @classmethod
+    def from_texts(cls, directory: str, texts: list[str], embeddings, metadatas: list[dict] | None = None,
+                   ids: list[str] | None = None) -> "MemmapVectorStore":
+        """
+        Create a store in a directory from the given texts, replacing anything saved there.
+        """
+        store = cls.clear(directory, embeddings)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def load(cls, directory: str, embeddings) -> "MemmapVectorStore":
+        """
+        Open the store saved in a directory, raising FileNotFoundError if there is none.
+        """
+        if not os.path.exists(os.path.join(directory, cls.META_FILE)):
+            raise FileNotFoundError(f"No vector store is saved in {directory}.")
+        return cls(directory, embeddings)
+
+    @classmethod
+    def clear(cls, directory: str, embeddings) -> "MemmapVectorStore":
+        """
+        Remove the store saved in a directory, returning an empty store in its place.
+        """
+        store = cls(directory, embeddings)
+        with store._locked(exclusive=True):
+            if os.path.exists(store.meta_path):
+                os.remove(store.meta_path)
+            store._load()
+            store._remove_obsolete()
+        return store
+
+    def _path(self, kind: str, generation: int | None = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"{kind}-{generation}.{self.KINDS[kind]}")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, self.META_FILE)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        """
+        Hold a lock on the directory, exclusive while saving and shared while loading.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, self.LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        """
+        Load the committed state, then apply the changes that are not saved yet on top of it.
+        Must be called with the directory locked.
+        """
+        try:
+            with open(self.meta_path, "r") as fr:
+                meta = json.load(fr)
+        except FileNotFoundError:
+            meta = {"generation": 0, "count": 0, "ids": [], "metadatas": [], "offsets": [0], "deleted": []}
+
+        if self._texts is not None:
+            self._texts.close()
+        self.generation = meta["generation"]
+        self.count = meta["count"]
+        self.ids = meta["ids"]
+        self.metadatas = meta["metadatas"]
+        self.offsets = meta["offsets"]
+        self.live = np.ones(self.count, dtype=bool)
+        self.live[meta["deleted"]] = False
+        if self.count:
+            self.vectors = np.load(self._path("vectors"), mmap_mode="r")
+            self.norms = np.load(self._path("norms"), mmap_mode="r")
+            self._texts = open(self._path("texts"), "rb")
+        else:
+            self.vectors = self.norms = self._texts = None
+
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids) if self.live[row]}
+        self.delete(list(self._deleted_ids))
+        for i, chunk_id in enumerate(self._pending_ids):
+            if self._pending_live[i]:
+                self.delete([chunk_id])  # an id that is added again replaces its old row
+                self._rows[chunk_id] = self.count + i
+
+    def __len__(self):
+        return int(self.live.sum() + self._pending_live.sum())
+
+    def add_texts(self, texts: list[str], metadatas: list[dict] | None = None,
+                  ids: list[str] | None = None) -> list[str]:
+        """
+        Embed texts and add them to the store. Call save to make them persistent.
+
+        :return: The ids of the added texts.
+        """
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+
+        embedded = np.asarray(self.embeddings.embed_documents(list(texts)), dtype=np.float32)
+        dim = self.vectors.shape[1] if self.vectors is not None else None
+        if self._pending_vectors is not None:
+            dim = self._pending_vectors.shape[1]
+        if dim is not None and embedded.shape[1] != dim:
+            raise ValueError(f"Expected embeddings of dimension {dim}, got {embedded.shape[1]}.")
+
+        start = self.count + len(self._pending_ids)
+        self._pending_vectors = embedded if self._pending_vectors is None else np.concatenate([self._pending_vectors, embedded])
+        self._pending_live = np.concatenate([self._pending_live, np.ones(len(texts), dtype=bool)])
+        for row, chunk_id in enumerate(ids, start=start):
+            self.delete([chunk_id])  # an id that is added again replaces its old row
+            self._rows[chunk_id] = row
+        self._pending_texts.extend(texts)
+        self._pending_ids.extend(ids)
+        self._pending_metadatas.extend(metadatas)
+        return ids
+
+    def delete(self, ids: list[str]):
+        """
+        Mark the chunks with the given ids as deleted. Unknown ids are ignored.
+        """
+        for chunk_id in ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is None:
+                continue
+            if row < self.count:
+                self.live[row] = False
+                self._deleted_ids.add(chunk_id)
+            else:
+                self._pending_live[row - self.count] = False
+
+    def _write_generation(self, rows: np.ndarray, capacity: int, dim: int) -> tuple[int, list[int]]:
+        """
+        Copy the given committed rows into the files of a new generation, with room for capacity rows.
+
+        :return: The new generation and the text offsets of the copied rows.
+        """
+        generation = self.generation + 1
+        vectors = np.lib.format.open_memmap(self._path("vectors", generation), mode="w+", dtype=np.float32,
+                                            shape=(capacity, dim))
+        norms = np.lib.format.open_memmap(self._path("norms", generation), mode="w+", dtype=np.float32,
+                                          shape=(capacity,))
+        offsets = [0]
+        with open(self._path("texts", generation), "wb") as fw:
+            for i, row in enumerate(rows):
+                vectors[i] = self.vectors[row]
+                norms[i] = self.norms[row]
+                data = self._read_text(row)
+                fw.write(data)
+                offsets.append(offsets[-1] + len(data))
+        vectors.flush()
+        norms.flush()
+        return generation, offsets
+
+    def save(self):
+        """
+        Commit the changes made since the last save on top of whatever other processes have
+        saved since, compacting the files into a new generation if most of their rows are deleted.
+        """
+        with self._locked(exclusive=True):
+            self._load()  # pick up what other processes saved, keeping this one's changes
+            added = np.flatnonzero(self._pending_live)
+            if not len(added) and not self._deleted_ids:
+                return
+
+            dim = (self._pending_vectors if self._pending_vectors is not None else self.vectors).shape[1]
+            capacity = 0 if self.vectors is None else self.vectors.shape[0]
+            compact = self.count and self.live.sum() < self.count / 2
+
+            if compact or self.count + len(added) > capacity:
+                # copy the rows into a new generation, twice the size if they do not fit, so
+                # appends take amortised constant time and the committed files are left untouched
+                rows = np.flatnonzero(self.live) if compact else np.arange(self.count)
+                needed = len(rows) + len(added)
+                generation, offsets = self._write_generation(
+                    rows, max(2 * capacity if needed > capacity else capacity, needed, 1024), dim
+                )
+                ids = [self.ids[row] for row in rows]
+                metadatas = [self.metadatas[row] for row in rows]
+                live = self.live[rows]
+            else:
+                generation, offsets = self.generation, list(self.offsets)
+                ids, metadatas, live = list(self.ids), list(self.metadatas), self.live.copy()
+            start = len(ids)
+
+            if len(added):
+                # append past the last committed row, which no reader of the committed state looks at
+                embedded = self._pending_vectors[added]
+                vectors = np.load(self._path("vectors", generation), mmap_mode="r+")
+                norms = np.load(self._path("norms", generation), mmap_mode="r+")
+                vectors[start:start + len(added)] = embedded
+                norms[start:start + len(added)] = np.einsum("ij,ij->i", embedded, embedded)
+                vectors.flush()
+                norms.flush()
+                del vectors, norms
+
+                with open(self._path("texts", generation), "r+b") as fw:
+                    fw.seek(offsets[-1])  # overwrites anything left by a save that was interrupted
+                    for i in added:
+                        data = self._pending_texts[i].encode("utf-8")
+                        fw.write(data)
+                        offsets.append(offsets[-1] + len(data))
+                ids.extend(self._pending_ids[i] for i in added)
+                metadatas.extend(self._pending_metadatas[i] for i in added)
+                live = np.concatenate([live, np.ones(len(added), dtype=bool)])
+
+            meta = {
+                "generation": generation,
+                "count": len(ids),
+                "ids": ids,
+                "metadatas": metadatas,
+                "offsets": offsets,
+                "deleted": np.flatnonzero(~live).tolist(),
+            }
+            tmp_path = self.meta_path + ".tmp"
+            with open(tmp_path, "w") as fw:
+                json.dump(meta, fw)
+            os.replace(tmp_path, self.meta_path)
+
+            self._pending_vectors = None
+            self._pending_live = np.empty(0, dtype=bool)
+            self._pending_texts, self._pending_ids, self._pending_metadatas = [], [], []
+            self._deleted_ids = set()
+            self._load()
+            self._remove_obsolete()
+
+    def _remove_obsolete(self):
+        """
+        Remove the files of every generation but the committed one. Processes that still have
+        them open keep reading them, and on Windows, where open files cannot be removed, they
+        are left for a later save.
+        """
+        current = {os.path.basename(self._path(kind)) for kind in self.KINDS}
+        for filename in os.listdir(self.directory):
+            if filename.startswith(tuple(f"{kind}-" for kind in self.KINDS)) and filename not in current:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def _read_text(self, row: int) -> bytes:
+        with self._texts_lock:
+            self._texts.seek(self.offsets[row])
+            return self._texts.read(self.offsets[row + 1] - self.offsets[row])
+
+    def _document(self, row: int) -> Document:
+        if row >= self.count:
+            i = row - self.count
+            return Document(id=self._pending_ids[i], page_content=self._pending_texts[i], metadata=self._pending_metadatas[i])
+        return Document(id=self.ids[row], page_content=self._read_text(row).decode("utf-8"), metadata=self.metadatas[row])
+
+    def similarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4) -> list[tuple[Document, float]]:
+        """
+        Find the k chunks closest to an embedding, by exact search over every row.
+
+        :return: The chunks and their squared L2 distances to the embedding, closest first.
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        parts = []
+        if self.count:
+            distances = self.norms[:self.count] - 2 * (self.vectors[:self.count] @ query) + query @ query
+            distances[~self.live] = np.inf
+            parts.append(distances)
+        if self._pending_vectors is not None:
+            pending = self._pending_vectors
+            distances = np.einsum("ij,ij->i", pending, pending) - 2 * (pending @ query) + query @ query
+            distances[~self._pending_live] = np.inf
+            parts.append(distances)
+        distances = np.concatenate(parts)
+
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(self._document(row), float(distances[row])) for row in top]
+
+    def similarity_search(self, query: str, k: int = 4) -> list[Document]:
+        """
+        Find the k chunks closest to a query, only the query itself is embedded.
+        """
+        results = self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k=k)
+        return [document for document, _ in results]
@@ -0,0 +1,206 @@
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histogram:
+    """
+    The distribution of a span's durations, counted into fixed buckets like a Prometheus
+    histogram, so recording an observation takes constant time and memory.
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket counts everything above the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Metrics:
+    """
+    Collects how long each stage of the assistant takes, as histograms of named spans. Spans
+    are timed with
+
+        with metrics.span("transcribe"):
+            ...
+
+    While disabled, which is the default, span returns a shared object that does nothing, so
+    the instrumentation costs next to nothing. The histograms can be dumped as JSON lines or
+    served over HTTP in the Prometheus text format.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, enabled: bool = False, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        :param enabled: Whether spans are recorded.
+        :param buckets: The upper bounds of the histogram buckets in seconds, in increasing order.
+        """
+        self.enabled = enabled
+        self.buckets = buckets
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def span(self, name: str):
+        """
+        A context manager that records how long its block takes under the given name.
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def observe(self, name: str, seconds: float):
+        """
+        Record a duration under the given name.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def summary(self) -> dict[str, dict]:
+        """
+        The count, total, mean, estimated p50 and p95, and maximum duration of each span, in seconds.
+        """
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def dump(self, path: str):
+        """
+        Append the summary of each span to a file as JSON lines, one per span, with the time of the dump.
+        """
+        timestamp = time.time()
+        summary = self.summary()
+        if not summary:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as fw:
+            for name, stats in summary.items():
+                fw.write(json.dumps({"timestamp": timestamp, "span": name, **stats}) + "\n")
+
+    def prometheus(self) -> str:
+        """
+        The histograms in the Prometheus text exposition format.
+        """
+        lines = ["# TYPE assistant_span_seconds histogram"]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'assistant_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'assistant_span_seconds_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'assistant_span_seconds_count{{span="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9100, host: str = "127.0.0.1"):
+        """
+        Serve the histograms at http://host:port/metrics from a background thread, for
+        Prometheus to scrape.
+        """
+        if self._server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on http://{host}:{self._server.server_address[1]}/metrics")
+
+    def stop_serving(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = Metrics()  # shared by every module, enabled by the application
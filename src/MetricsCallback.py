@@ -0,0 +1,39 @@
+import time
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from Metrics import Metrics
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Times every LLM call made through LangChain, whether invoked, batched or streamed, as the
+    "llm" span, and the time to the first streamed token as "llm_first_token".
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._started: dict[UUID, float] = {}
+        self._streaming: set[UUID] = set()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        if self.metrics.enabled:
+            self._started[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        if run_id in self._started and run_id not in self._streaming:
+            self._streaming.add(run_id)
+            self.metrics.observe("llm_first_token", time.perf_counter() - self._started[run_id])
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._finish("llm", run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._finish("llm_error", run_id)
+
+    def _finish(self, name: str, run_id: UUID):
+        started = self._started.pop(run_id, None)
+        self._streaming.discard(run_id)
+        if started is not None:
+            self.metrics.observe(name, time.perf_counter() - started)
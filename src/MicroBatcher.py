@@ -0,0 +1,157 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generic, TypeVar
+
+from langchain_core.embeddings import Embeddings
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class _Slot:
+    __slots__ = ("item", "result", "error", "done")
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error: BaseException | None = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Coalesces calls made from many threads into batches, so that requests arriving within a
+    short window of each other, such as those of concurrent calls, share one API request.
+
+    A batch is dispatched once it holds max_batch_size items, or max_wait seconds after its
+    first item arrived, whichever comes first. Up to max_concurrency batches are in flight at
+    once, and each caller blocks until the result for its own item is back.
+    """
+
+    def __init__(self, process_batch: Callable[[list[T]], list[R]], max_batch_size: int = 16,
+                 max_wait: float = 0.01, max_concurrency: int = 4, name: str = "micro-batcher"):
+        """
+        :param process_batch: Processes a batch of items, returning one result per item in the same order.
+        :param max_batch_size: The largest number of items in a batch.
+        :param max_wait: The longest time in seconds an item waits for others to join its batch.
+        :param max_concurrency: The number of batches processed at once.
+        :param name: The name of the dispatching thread.
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+
+        self.batches = 0
+        self.items = 0
+
+        self._pending: list[_Slot] = []
+        self._first_arrival = 0.0
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        self._dispatcher: threading.Thread | None = None
+        self._closed = False
+
+    def submit(self, item: T) -> R:
+        """
+        Process an item as part of the next batch, waiting for its result.
+
+        :param item: The item to process.
+        :return: The result for the item.
+        """
+        slot = _Slot(item)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError(f"The {self.name} has been closed.")
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name=self.name, daemon=True)
+                self._dispatcher.start()
+            if not self._pending:
+                self._first_arrival = time.monotonic()
+            self._pending.append(slot)
+            self._condition.notify()
+
+        slot.done.wait()
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if self._closed and not self._pending:
+                    return
+                deadline = self._first_arrival + self.max_wait
+                while len(self._pending) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                if self._pending:
+                    self._first_arrival = time.monotonic()  # the overflow starts the next batch
+                self.batches += 1
+                self.items += len(batch)
+
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch: list[_Slot]):
+        try:
+            results = self.process_batch([slot.item for slot in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Expected {len(batch)} results from the batch, got {len(results)}.")
+        except BaseException as e:
+            for slot in batch:
+                slot.error = e
+                slot.done.set()
+            return
+
+        for slot, result in zip(batch, results):
+            slot.result = result
+            slot.done.set()
+
+    def close(self):
+        """
+        Dispatch anything still pending and stop the dispatching thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        self._executor.shutdown()
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings whose queries, embedded one at a time by each caller, are coalesced into
+    batched embed_documents calls. This is only valid for models that embed queries and
+    documents the same way, as OpenAI's do.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 16, max_wait: float = 0.01):
+        """
+        :param embeddings: The embeddings to batch the queries of.
+        :param max_batch_size: The largest number of queries embedded in one request.
+        :param max_wait: The longest time in seconds a query waits for others to join its request.
+        """
+        self.embeddings = embeddings
+        self.batcher = MicroBatcher(embeddings.embed_documents, max_batch_size=max_batch_size,
+                                    max_wait=max_wait, name="embedding-batcher")
+
+    @property
+    def model(self) -> str:
+        return getattr(self.embeddings, "model", type(self.embeddings).__name__)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)  # already a batch
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.batcher.submit(text)
+
+    def close(self):
+        self.batcher.close()
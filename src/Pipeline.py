@@ -0,0 +1,176 @@
+import threading
+from queue import Queue, Empty, Full
+from typing import Callable
+
+END_OF_STREAM = object()  # put on a queue once every stage feeding it has finished
+
+
+class Stage(threading.Thread):
+    """
+    A stage of the pipeline, running in its own thread. Each item taken from the inbox is
+    passed to the stage's work function, and whatever it returns (other than None) is put
+    on the outbox. A stage without an inbox is a source, and calls its work function with no
+    arguments until the pipeline stops or it raises EOFError.
+
+    Once every stage feeding a queue has finished, END_OF_STREAM is put on it, and the stage
+    taking items from it finishes in turn when it gets there, so a pipeline whose sources
+    run out of input finishes on its own.
+
+    The queues are bounded, so a stage that falls behind makes the stages before it wait
+    rather than letting work pile up.
+    """
+
+    def __init__(self, name: str, work: Callable, inbox: Queue | None, outbox: Queue | None,
+                 stop_event: threading.Event, poll_interval: float = 0.1, feeds: tuple[Queue, ...] = (),
+                 on_finish: Callable[["Stage"], None] | None = None):
+        """
+        :param name: The name of the stage, used in error messages.
+        :param work: Processes an item from the inbox, or produces an item if there is no inbox.
+        :param inbox: The queue items are taken from, None for a source.
+        :param outbox: The queue results are put on, None if the stage produces no results.
+        :param stop_event: Set when the pipeline is stopping.
+        :param poll_interval: How often in seconds a waiting stage checks whether the pipeline is stopping.
+        :param feeds: Other queues the work function puts items on itself, which are ended like the outbox.
+        :param on_finish: Called with the stage once it has run out of input.
+        """
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.poll_interval = poll_interval
+        self.outboxes = ((outbox,) if outbox is not None else ()) + tuple(feeds)
+        self.on_finish = on_finish
+        self.finished = False
+
+    def run(self):
+        self._run()
+        if not self.stop_event.is_set() and self.on_finish is not None:
+            self.on_finish(self)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.inbox is None:
+                    result = self.work()
+                else:
+                    try:
+                        item = self.inbox.get(timeout=self.poll_interval)
+                    except Empty:
+                        continue
+                    if item is END_OF_STREAM:
+                        return
+                    result = self.work(item)
+            except EOFError:
+                return  # the source has no more input, e.g. its recorder was stopped
+            except Exception as e:
+                if not self.stop_event.is_set():
+                    print(f"Error in the {self.name} stage: {e}. Continuing...")
+                continue
+
+            if result is not None and self.outbox is not None:
+                self.put(result)
+
+    def put(self, item, queue: Queue | None = None):
+        """
+        Put an item on the outbox, or the given queue, waiting for space unless the pipeline stops first.
+        """
+        queue = self.outbox if queue is None else queue
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=self.poll_interval)
+                return
+            except Full:
+                continue
+
+
+def put_latest(queue: Queue, item):
+    """
+    Put an item on a queue, discarding any items still waiting in it, for queues where only
+    the newest item is worth processing.
+
+    :param queue: The queue to put the item on.
+    :param item: The item to put.
+    """
+    while True:
+        try:
+            queue.put_nowait(item)
+            return
+        except Full:
+            try:
+                queue.get_nowait()
+            except Empty:
+                pass
+
+
+class Pipeline:
+    """
+    A set of stages connected by bounded queues, which are started and stopped together.
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.stages: list[Stage] = []
+        self.stop_callbacks: list[Callable[[], None]] = []
+        self.started = False
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, work: Callable, inbox: Queue | None = None, outbox: Queue | None = None,
+                  feeds: tuple[Queue, ...] = ()) -> Stage:
+        """
+        Add a stage to the pipeline, see Stage. A stage added to a running pipeline is started
+        straight away, such as a recording stage for a speaker who joins a call late.
+
+        :param feeds: Other queues the work function puts items on itself, so they are ended
+            once every stage feeding them has finished.
+        :return: The stage that was added.
+        """
+        stage = Stage(name, work, inbox, outbox, self.stop_event, feeds=feeds, on_finish=self._stage_finished)
+        self.stages.append(stage)
+        if self.started:
+            stage.start()
+        return stage
+
+    def _stage_finished(self, stage: Stage):
+        """
+        End each queue the stage fed that no other running stage feeds.
+        """
+        with self._lock:
+            stage.finished = True
+            ended = [
+                queue for queue in stage.outboxes
+                if all(other.finished for other in self.stages if any(q is queue for q in other.outboxes))
+            ]
+        for queue in ended:
+            stage.put(END_OF_STREAM, queue)
+
+    def on_stop(self, callback: Callable[[], None]):
+        """
+        Register a callback that unblocks a stage when the pipeline stops, such as stopping
+        the recorder a source stage is waiting on.
+        """
+        self.stop_callbacks.append(callback)
+
+    def start(self):
+        self.started = True
+        for stage in self.stages:
+            stage.start()
+
+    def wait(self):
+        """
+        Wait until every stage has finished, staying responsive to KeyboardInterrupt.
+        """
+        for stage in list(self.stages):
+            while stage.is_alive():
+                stage.join(timeout=0.5)
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop every stage, waiting up to timeout seconds for each to finish its current item.
+        """
+        self.stop_event.set()
+        for callback in self.stop_callbacks:
+            callback()
+        for stage in list(self.stages):
+            if stage.is_alive():
+                stage.join(timeout=timeout)
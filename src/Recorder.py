@@ -1,14 +1,34 @@
-import soundcard as sc
 import soundfile as sf
-import numpy as np
 import time
 import os
+import threading
 from collections import deque
+from contextlib import nullcontext
+
+from AudioEncoder import AudioEncoder
+from AudioBuffer import AudioBuffer, RingBuffer, RingBufferReader
+from VoiceActivityDetector import VoiceActivityDetector, Endpointer
+from Metrics import metrics
 
 class Recorder:
     def __init__(self, mode, output_dir="rec", samplerate=40000,
                  max_files=7, silence_threshold=0.01, silence_duration=2.0,
-                 max_recording_duration_mins=2):
+                 max_recording_duration_mins=2, continuous=False, capture_buffer_secs=60,
+                 min_silence_duration=0.3, save_recordings=False, source=None, partial_interval=1.0):
+        """
+        :param partial_interval: How many seconds of an utterance are recorded between each call
+            to on_partial while it is in progress.
+        :param source: Something to record from in place of the sound card, with a
+            record(numframes) method like a device recorder, such as a FileSource.
+        :param save_recordings: Also write each recording to output_dir as a WAV file, for debugging.
+        :param silence_duration: The longest silence in seconds before an utterance is ended.
+        :param min_silence_duration: The shortest silence in seconds that can end an utterance,
+            used when the endpointer is confident the speaker has finished.
+        :param continuous: Keep one device stream open for the whole session, capturing audio
+            in a background thread so nothing said between recordings is lost.
+        :param capture_buffer_secs: In continuous mode, how much captured audio is kept before
+            it is overwritten if the recordings fall behind.
+        """
         
         if mode in ["microphone", "speaker"]:
             self.mode = mode
@@ -20,61 +40,127 @@ class Recorder:
         self.max_files = max_files
         self.silence_threshold = silence_threshold
         self.silence_duration = silence_duration
+        self.min_silence_duration = min_silence_duration
+        self.vad = VoiceActivityDetector(samplerate, threshold=silence_threshold)
+        self.encoder = AudioEncoder()
+        self.save_recordings = save_recordings
         self.max_recording_duration = max_recording_duration_mins * 60
+        self.buffer = AudioBuffer(initial_capacity=samplerate * 10)  # reused by every recording, grows past 10 secs if needed
+        self.partial_interval = partial_interval
+        self.on_partial = None  # called with a copy of the utterance so far, must not block the recording
+
+        self.source = source
+        self.continuous = continuous
+        self.capture_buffer_secs = capture_buffer_secs
+        self._ring: RingBuffer | None = None
+        self._reader: RingBufferReader | None = None
+        self._capture_thread: threading.Thread | None = None
+        self._stop_capture = threading.Event()
 
         os.makedirs(self.output_dir, exist_ok=True)
 
     def is_silence(self, data):
         """Check if the audio data is silent."""
-        return np.mean(np.abs(data)) < self.silence_threshold
+        return not self.vad.is_speech(data)
 
     def wait_for_sound(self, mic):
-        """Wait until sound is detected."""
+        """Wait until sound is detected, returning the first frames containing sound."""
         while True:
             data = mic.record(numframes=self.samplerate // 10)  # 0.1 secs recorded
             if not self.is_silence(data):
-                break
+                return data
 
-    def record_until_silence(self, output_file_name):
-        """Record audio until silence or maximum duration is reached."""
+    def open_device(self):
+        """Open a recorder on the device for this mode, to be used as a context manager."""
+        if self.source is not None:
+            return nullcontext(self.source)
 
+        import soundcard as sc  # only needed when recording from a device
         if self.mode == "microphone":
-            with sc.default_microphone().recorder(samplerate=self.samplerate) as mic:
-                self.record_audio(output_file_name, mic)
-        elif self.mode == "speaker":
-            with sc.get_microphone(id=str(sc.default_speaker().name), include_loopback=True).recorder(samplerate=self.samplerate) as mic:
-                self.record_audio(output_file_name, mic)
-
-    def record_audio(self, output_file_name, mic):
-        self.wait_for_sound(mic)  # Wait until sound is detected
-
-        frames = []
-        start_time = time.time()
-
+            return sc.default_microphone().recorder(samplerate=self.samplerate)
+        return sc.get_microphone(id=str(sc.default_speaker().name), include_loopback=True).recorder(samplerate=self.samplerate)
+
+    def start_capture(self):
+        """Start capturing audio from the device into a ring buffer in a background thread."""
+        if self._capture_thread is not None:
+            return
+
+        self._ring = RingBuffer(capacity=self.samplerate * self.capture_buffer_secs)
+        self._reader = RingBufferReader(self._ring)
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+
+    def _capture_loop(self, min_backoff=0.5, max_backoff=5.0):
+        """
+        Capture audio until stop is called. If the device fails, such as when it is unplugged,
+        it is reopened after a delay that doubles on each consecutive failure, so a device
+        error only loses the audio said while it was down. The end of a source such as a
+        FileSource ends the capture.
+        """
+        backoff = min_backoff
+        try:
+            while not self._stop_capture.is_set():
+                try:
+                    with self.open_device() as mic:
+                        while not self._stop_capture.is_set():
+                            self._ring.write(mic.record(numframes=self.samplerate // 10))  # 0.1 secs recorded
+                            backoff = min_backoff
+                except EOFError:
+                    return
+                except Exception as e:
+                    print(f"Error in the {self.mode} capture thread: {e}. Reopening the device in {backoff:.1f} secs...")
+                    self._stop_capture.wait(backoff)
+                    backoff = min(backoff * 2, max_backoff)
+        finally:
+            self._ring.close()
+
+    def stop(self):
+        """Stop the background capture, after which nothing more can be recorded in continuous mode."""
+        self._stop_capture.set()
+        if self._capture_thread is not None:
+            self._capture_thread.join()
+            self._capture_thread = None
+
+    def record_until_silence(self):
+        """Record audio until silence or maximum duration is reached, returning a view of the first channel."""
+
+        if self.continuous:
+            if self._stop_capture.is_set():
+                raise EOFError("The recorder has been stopped.")
+            self.start_capture()
+            return self.record_audio(self._reader)  # cut the next utterance out of the captured stream
+        with self.open_device() as mic:
+            return self.record_audio(mic)
+
+    def record_audio(self, mic):
+        data = self.wait_for_sound(mic)  # Wait until sound is detected
+
+        frames = self.buffer
+        frames.clear()
+        frames.append(data)  # keep the frames that triggered the recording, so the first word isn't clipped
+        endpointer = Endpointer(self.vad, min_silence=self.min_silence_duration, max_silence=self.silence_duration)
+        endpointer.update(data)
+        next_partial = self.partial_interval * self.samplerate
+
+        # durations are measured in recorded frames rather than wall time, so that audio read
+        # from the capture buffer faster than real time is still cut at the right place
         while True:
             data = mic.record(numframes=self.samplerate // 10)  # 0.1 secs recorded
             frames.append(data)
 
-            flat_data = np.concatenate(frames)
-
-            if self.is_silence(data):
-                silence_start = time.time()
-                while time.time() - silence_start < self.silence_duration:
-                    data = mic.record(numframes=self.samplerate // 10)
-                    frames.append(data)
-                    if not self.is_silence(data):
-                        break
-                else:
-                        # end of sentence here
-                    break
+            if endpointer.update(data):
+                # end of sentence here
+                break
 
-            if time.time() - start_time > self.max_recording_duration:
+            if len(frames) > self.max_recording_duration * self.samplerate:
                 print("Maximum recording duration reached.")
                 break
 
-        audio_data = np.concatenate(frames)
+            if self.on_partial is not None and len(frames) >= next_partial:
+                self.on_partial(frames.view()[:, 0].copy())  # the buffer is reused, so the callback gets a copy
+                next_partial += self.partial_interval * self.samplerate
 
-        sf.write(file=output_file_name, data=audio_data[:, 0], samplerate=self.samplerate)
+        return frames.view()[:, 0]
 
     def manage_files(self, file_list):
         """Manage a rotating list of files, keeping only the most recent ones."""
@@ -90,7 +176,10 @@ class Recorder:
         return deque(files)
 
     def record(self):
-        """Main recording loop to record audio and manage files."""
+        """
+        Record the next utterance, returning it resampled and encoded in memory, ready to be
+        transcribed. The recording is only written to disk if save_recordings is set.
+        """
 
         try:
             label: str = ""
@@ -99,18 +188,59 @@ class Recorder:
             elif self.mode == "speaker":
                 label = "callee_"
 
-            file_list = self.get_file_list()
-
             current_time = time.strftime("%Y%m%d_%H%M%S")
-            output_file_name = os.path.join(self.output_dir, f"{current_time}_{label}.wav") # This way, we can order by name to get oldest to newest
+            name = f"{current_time}_{label}" # This way, we can order by name to get oldest to newest
+
+            with metrics.span(f"record_{self.mode}"):  # includes waiting for the speaker to start
+                audio_data = self.record_until_silence()
 
-            self.record_until_silence(output_file_name)
-            file_list.append(output_file_name)
-            return output_file_name
+            if self.save_recordings:
+                file_list = self.get_file_list()
+                output_file_name = os.path.join(self.output_dir, f"{name}.wav")
+                sf.write(file=output_file_name, data=audio_data, samplerate=self.samplerate)
+                file_list.append(output_file_name)
+                self.manage_files(file_list)
+
+            with metrics.span("encode"):
+                return self.encoder.encode(audio_data, self.samplerate, name=name)
 
         except KeyboardInterrupt:
             print("Recording stopped by user.")
 
+class FileSource:
+    """
+    Plays a WAV file into a Recorder in place of the sound card, so recordings can be made
+    without a device, such as in the benchmarks. Recording past the end of the file raises
+    EOFError, which ends the recording stages of the pipeline.
+    """
+
+    def __init__(self, path, samplerate, realtime=False):
+        """
+        :param path: The WAV file to play.
+        :param samplerate: The samplerate of the recorder, which the file must match.
+        :param realtime: Return audio no faster than it would be recorded, which continuous
+            mode needs so that its capture buffer does not overflow.
+        """
+        self.data, file_samplerate = sf.read(path, dtype="float32", always_2d=True)
+        if file_samplerate != samplerate:
+            raise ValueError(f"{path} has a samplerate of {file_samplerate}, but the recorder expects {samplerate}.")
+        self.samplerate = samplerate
+        self.realtime = realtime
+        self.position = 0
+        self._started = None
+
+    def record(self, numframes):
+        if self.position >= len(self.data):
+            raise EOFError("The end of the audio file was reached.")
+        if self._started is None:
+            self._started = time.monotonic()
+
+        frames = self.data[self.position:self.position + numframes]
+        self.position += len(frames)
+        if self.realtime:
+            time.sleep(max(0.0, self._started + self.position / self.samplerate - time.monotonic()))
+        return frames
+
 if __name__ == "__main__":
-    recorder = Recorder(mode="speaker")
+    recorder = Recorder(mode="speaker", save_recordings=True)
     recorder.record()
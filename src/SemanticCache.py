@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Caches generated responses by the embedding of what prompted them, so that a
+    conversational state close enough to one seen before (the same objection, phrased
+    slightly differently) returns the earlier response instead of generating a new one.
+
+    An entry only matches if it was generated against the same version of the document
+    index, and expires after ttl seconds. The least recently used entries are evicted
+    beyond max_entries.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 1800.0, max_entries: int = 256):
+        """
+        :param threshold: The cosine similarity above which two keys are treated as the same.
+        :param ttl: The number of seconds an entry stays valid.
+        :param max_entries: The maximum number of entries kept.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[int, tuple[np.ndarray, object, str, float]] = OrderedDict()
+        self._next_id = 0
+        self._matrix: np.ndarray | None = None  # the entry vectors stacked, rebuilt after a change
+        self._ids: list[int] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalise(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [entry_id for entry_id, (_, _, _, created) in self._entries.items() if now - created > self.ttl]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        if expired:
+            self._matrix = None
+
+    def get(self, vector, version) -> str | None:
+        """
+        Look up the response for the entry most similar to the given key.
+
+        :param vector: The embedding of the key.
+        :param version: The version of the document index the response must have been generated against.
+        :return: The cached response, or None if no entry is similar enough.
+        """
+        with self._lock:
+            self._expire()
+            if self._entries and self._matrix is None:
+                self._ids = list(self._entries)
+                self._matrix = np.stack([self._entries[entry_id][0] for entry_id in self._ids])
+
+            if self._entries:
+                similarities = self._matrix @ self._normalise(vector)
+                for i in np.argsort(similarities)[::-1]:
+                    if similarities[i] < self.threshold:
+                        break
+                    entry_id = self._ids[i]
+                    _, entry_version, response, _ = self._entries[entry_id]
+                    if entry_version == version:
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return response
+
+            self.misses += 1
+            return None
+
+    def put(self, vector, version, response: str):
+        """
+        Cache a response under the given key.
+
+        :param vector: The embedding of the key.
+        :param version: The version of the document index the response was generated against.
+        :param response: The response to cache.
+        """
+        with self._lock:
+            self._entries[self._next_id] = (self._normalise(vector), version, response, time.monotonic())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
@@ -0,0 +1,90 @@
+import re
+
+import numpy as np
+from langchain_core.prompts import PromptTemplate
+
+from MicroBatcher import MicroBatcher
+
+
+class SentenceRanker:
+    """
+    Scores candidate sentences by their relevance to a query, scoring all of the sentences
+    at once rather than making a request per sentence.
+
+    Modes:
+        "llm": a single LLM call rates every sentence from 1 to 10. Rating prompts from
+            concurrent calls are coalesced into one multi-prompt completion request.
+        "embedding": the cosine similarity between each sentence and the query, computed as
+            one matrix-vector product. This needs no LLM call, and the query embedding is
+            usually already cached from retrieval.
+    """
+
+    MODES = ("llm", "embedding")
+
+    ranking_prompt = PromptTemplate(
+        template=(
+            "Query:\n{query}\n\n"
+            "Sentences:\n{sentences}\n\n"
+            "Rate the relevance of each sentence to the query on a scale of 1 to 10, "
+            "where 10 means highly relevant and 1 means not relevant at all. "
+            "Answer with one line per sentence in the form '<sentence number>: <rating>', and nothing else."
+        ),
+        input_variables=["query", "sentences"]
+    )
+
+    def __init__(self, llm, embeddings, mode: str = "llm", max_batch_size: int = 16, max_batch_wait: float = 0.01):
+        """
+        :param llm: The LLM used in "llm" mode.
+        :param embeddings: The embeddings used in "embedding" mode.
+        :param mode: The scoring mode, one of SentenceRanker.MODES.
+        :param max_batch_size: The largest number of rating prompts sent in one request.
+        :param max_batch_wait: The longest time in seconds a rating prompt waits for others to join its request.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown mode: {mode}. Please use one of {', '.join(self.MODES)} in SentenceRanker class.")
+
+        self.llm = llm
+        self.embeddings = embeddings
+        self.mode = mode
+        self.batcher = MicroBatcher(self._rate, max_batch_size=max_batch_size, max_wait=max_batch_wait,
+                                    name="ranking-batcher")
+
+    def close(self):
+        self.batcher.close()
+
+    def score(self, sentences: list[str], query: str) -> list[float]:
+        """
+        Score each sentence by its relevance to the query.
+
+        :param sentences: The candidate sentences.
+        :param query: The user query for context.
+        :return: A score per sentence, higher is more relevant.
+        """
+        if not sentences:
+            return []
+        if self.mode == "embedding":
+            return self._score_by_embedding(sentences, query)
+        return self._score_by_llm(sentences, query)
+
+    def _score_by_llm(self, sentences: list[str], query: str) -> list[float]:
+        numbered = "\n".join(f"{i}. {sentence}" for i, sentence in enumerate(sentences, start=1))
+        rating_response = self.batcher.submit(self.ranking_prompt.format(query=query, sentences=numbered))
+
+        scores = [0.0] * len(sentences)  # sentences the LLM did not rate are ranked last
+        for match in re.finditer(r"^\s*(\d+)\s*[:.)-]\s*(\d+(?:\.\d+)?)", rating_response, re.MULTILINE):
+            index = int(match.group(1)) - 1
+            if 0 <= index < len(sentences):
+                scores[index] = float(match.group(2))
+        return scores
+
+    def _rate(self, prompts: list[str]) -> list[str]:
+        result = self.llm.generate(prompts)
+        return [generations[0].text for generations in result.generations]
+
+    def _score_by_embedding(self, sentences: list[str], query: str) -> list[float]:
+        sentence_vectors = np.asarray(self.embeddings.embed_documents(sentences), dtype=np.float32)
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+
+        norms = np.linalg.norm(sentence_vectors, axis=1) * np.linalg.norm(query_vector)
+        similarities = (sentence_vectors @ query_vector) / np.maximum(norms, 1e-12)
+        return similarities.tolist()
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+
+from ApiClient import ApiClient
+from AudioBuffer import RingBuffer, RingBufferReader
+from CallSession import CallSession, get_files_in
+from LLMQuery import LLMQuery
+from Recorder import FileSource, Recorder
+from SpeechToText import AudioTranscriber
+
+
+class Server:
+    """
+    Hosts many calls in one process, each in its own CallSession, all sharing one LLM, and
+    with it one document index and API client pool.
+
+    Audio is pushed in over a local TCP socket, one connection per speaker in a call. Each
+    connection starts with a JSON header line:
+
+        {"session": "rep-12", "speaker": "CALLEE", "samplerate": 16000}
+
+    followed by the speaker's audio as mono 32-bit float samples. Instead of sending audio,
+    the header can name a WAV file to play with "file". A session starts with its first
+    connection and ends when its last one closes. Suggestions for the call are sent back on
+    every connection of its session as JSON lines, {"suggestion": "...", "first": true}, where
+    first marks the start of a new set of suggestions.
+    """
+
+    SPEAKERS = {"CALLEE": "speaker", "CALLER": "microphone"}  # speaker label -> recorder mode
+
+    def __init__(self, llm: LLMQuery, transcriber: AudioTranscriber, host: str = "127.0.0.1", port: int = 8765,
+                 sessions_dir: str = "sessions", doc_dir: str = "doc/", debug: bool = False,
+                 stream_suggestions: bool = True, buffer_secs: int = 60, speculative: bool = False,
+                 share_cache: bool = False):
+        """
+        :param llm: The LLM shared by every session.
+        :param transcriber: The transcriber shared by every session.
+        :param host: The host to listen on, keep it local as the connections are not authenticated.
+        :param port: The port to listen on, 0 for any free port.
+        :param sessions_dir: The directory each session's working directory is created in.
+        :param doc_dir: The directory of documents used as context.
+        :param debug: Save each session's recordings and transcriptions in its directory.
+        :param stream_suggestions: Send suggestions as they are generated, rather than ranked once they all are.
+        :param buffer_secs: How much audio is buffered per connection if its recordings fall behind.
+        :param speculative: Generate suggestions while the callee is still speaking, see CallSession.
+        :param share_cache: Let sessions serve each other's cached responses, see CallSession.
+        """
+        self.llm = llm
+        self.transcriber = transcriber
+        self.host = host
+        self.port = port
+        self.sessions_dir = sessions_dir
+        self.doc_dir = doc_dir
+        self.debug = debug
+        self.stream_suggestions = stream_suggestions
+        self.buffer_secs = buffer_secs
+        self.speculative = speculative
+        self.share_cache = share_cache
+
+        self.sessions: dict[str, CallSession] = {}
+        self._connections: dict[str, set[asyncio.StreamWriter]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.Server | None = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Serving calls on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """
+        Stop accepting connections and end every session.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for session_id in list(self.sessions):
+            await self._close_session(session_id)
+
+    def _render(self, session_id: str):
+        """
+        A render function for a session, sending its suggestions to every connection of the session.
+        """
+        def render(suggestions, is_stale=lambda: False):
+            first = True
+            for suggestion in suggestions:
+                if is_stale():
+                    suggestions.close()
+                    return
+                line = (json.dumps({"suggestion": suggestion, "first": first}) + "\n").encode("utf-8")
+                self._loop.call_soon_threadsafe(self._broadcast, session_id, line)
+                first = False
+        return render
+
+    def _broadcast(self, session_id: str, line: bytes):
+        for writer in self._connections.get(session_id, ()):
+            if not writer.is_closing():
+                writer.write(line)
+
+    def _open_session(self, session_id: str) -> CallSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = CallSession(session_id, self.llm, self.transcriber, self._render(session_id),
+                                  session_dir=os.path.join(self.sessions_dir, session_id), doc_dir=self.doc_dir,
+                                  debug=self.debug, stream_suggestions=self.stream_suggestions,
+                                  speculative=self.speculative, share_cache=self.share_cache)
+            session.cleanup()
+            session.start()
+            self.sessions[session_id] = session
+            self._connections[session_id] = set()
+            print(f"Session {session_id} started.")
+        return session
+
+    async def _close_session(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        self._connections.pop(session_id, None)
+        if session is not None:
+            await asyncio.to_thread(session.stop)
+            print(f"Session {session_id} ended.")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            header = json.loads(await reader.readline())
+            session_id = str(header["session"])
+            speaker = str(header.get("speaker", "CALLEE")).upper()
+            samplerate = int(header.get("samplerate", 16000))
+            if speaker not in self.SPEAKERS:
+                raise ValueError(f"Unknown speaker: {speaker}. Please use one of {', '.join(self.SPEAKERS)}.")
+            if not CallSession.ID_PATTERN.match(session_id):
+                raise ValueError(f"Invalid session id: {session_id}. Please use letters, digits, underscores and dashes.")
+            file_source = FileSource(header["file"], samplerate, realtime=True) if "file" in header else None
+        except Exception as e:
+            writer.write((json.dumps({"error": f"Invalid header: {e}"}) + "\n").encode("utf-8"))
+            await writer.drain()
+            writer.close()
+            return
+
+        session = self._open_session(session_id)
+        self._connections[session_id].add(writer)
+
+        ring = None
+        if file_source is None:
+            ring = RingBuffer(capacity=samplerate * self.buffer_secs)
+            source = RingBufferReader(ring, position=0)
+        else:
+            source = file_source
+        session.add_recorder(Recorder(mode=self.SPEAKERS[speaker], output_dir=session.path("rec"),
+                                      samplerate=samplerate, save_recordings=self.debug, source=source), speaker)
+
+        try:
+            pending = b""
+            while data := await reader.read(1 << 16):
+                if ring is None:
+                    continue  # audio comes from the file, the connection only receives suggestions
+                pending += data
+                usable = len(pending) - len(pending) % 4
+                if usable:
+                    ring.write(np.frombuffer(pending[:usable], dtype="<f4").reshape(-1, 1))
+                    pending = pending[usable:]
+        except ConnectionError:
+            pass
+        finally:
+            if ring is not None:
+                ring.close()  # ends the speaker's recording stage
+            connections = self._connections.get(session_id)
+            if connections is not None:
+                connections.discard(writer)
+                if not connections:
+                    await self._close_session(session_id)
+            writer.close()
+
+
+def main(host: str = "127.0.0.1", port: int = 8765):
+    api_client = ApiClient()  # one connection pool and retry policy shared by every call
+    transcriber = AudioTranscriber(api_client)
+    llm = LLMQuery(api_client=api_client)
+    llm.watch_documents(lambda: get_files_in(directory="doc/", ignored_files=["tmp.txt"]))
+    server = Server(llm, transcriber, host=host, port=port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("Server interrupted by user. Exiting...")
+    finally:
+        llm.stop()
+        api_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,40 @@
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 
+from ApiClient import ApiClient
+from Metrics import metrics
+
 
 class AudioTranscriber:
-    def __init__(self):
+    def __init__(self, api_client: ApiClient | None = None):
         """
-        Initialize the AudioTranscriber with the specified model type.
+        Initialize the AudioTranscriber.
 
-        :param model_type: The Whisper model type to use. Default is 'base'.
+        :param api_client: The connection pool and retry policy for API requests, shared with
+            the LLM. A new one is created if not given.
         """
         load_dotenv()
         openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=openai_api_key)
+        self.api_client = api_client or ApiClient()
+        self.client = self.api_client.openai(openai_api_key)
 
-    def transcribe(self, audio_path):
+    def transcribe(self, audio):
         """
-        Transcribe the given audio file.
+        Transcribe the given audio.
 
-        :param audio_path: Path to the audio file to transcribe.
+        :param audio: Path to the audio file to transcribe, or an in-memory file such as the
+            one returned by Recorder.record, named with the extension of its format.
         :return: The transcribed text.
         """
-        audio_file = open(audio_path, "rb")
-        transcription = self.client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
+        if isinstance(audio, (str, os.PathLike)):
+            with open(audio, "rb") as audio_file:
+                return self.transcribe(audio_file)
+
+        with metrics.span("transcribe"):
+            transcription = self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=(os.path.basename(getattr(audio, "name", "audio.wav")), audio)
+            )
         return transcription.text
         
 
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from typing import Callable
+
+
+class Summariser:
+    """
+    Keeps a rolling summary of the call in memory. Transcriptions that fall out of the
+    transcript are added to it straight away, and are compacted into the summary by a
+    background thread, so the recording and transcription threads never wait on the LLM.
+
+    Compaction is debounced: it only runs once enough transcriptions are pending and the
+    conversation has been quiet for a moment, unless the backlog grows too large. At most
+    2 * max_pending transcriptions are compacted at a time, oldest first, so a compaction
+    that fails is retried with the same batch rather than an ever larger one. If the LLM
+    keeps failing, the backlog is capped at max_backlog transcriptions by dropping the
+    oldest ones, so the summary cannot grow without bound. Snapshots
+    of the summary are written to disk periodically, replacing the previous one atomically.
+    """
+
+    def __init__(self, summarise: Callable[[str, list[str]], str], snapshot_path: str = "tmp/summary.txt",
+                 max_pending: int = 5, debounce: float = 2.0, persist_interval: float = 10.0,
+                 max_backlog: int = 50):
+        """
+        :param summarise: Combines the current summary with a list of transcriptions into a new summary.
+        :param snapshot_path: Where snapshots of the summary are written, None to keep it in memory only.
+        :param max_pending: The number of pending transcriptions that triggers a compaction.
+        :param debounce: The number of seconds without a new transcription to wait before compacting.
+        :param persist_interval: The minimum number of seconds between snapshots.
+        :param max_backlog: The most transcriptions kept waiting to be compacted.
+        """
+        self.summarise = summarise
+        self.snapshot_path = snapshot_path
+        self.max_pending = max_pending
+        self.debounce = debounce
+        self.persist_interval = persist_interval
+        self.max_backlog = max_backlog
+
+        self.summary = ""
+        self.pending: list[str] = []
+        self._dropped = 0  # transcriptions dropped from the front of pending so far
+        self._last_added = 0.0
+        self._last_persisted = 0.0
+        self._retry_after = 0.0
+        self._dirty = False
+
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def add(self, transcription: str):
+        """
+        Add a transcription to the summary, without waiting for it to be compacted.
+        """
+        with self._condition:
+            self.pending.append(transcription)
+            if len(self.pending) > self.max_backlog:
+                print(f"The summary is {len(self.pending)} transcriptions behind, dropping the oldest.")
+                self._dropped += len(self.pending) - self.max_backlog
+                del self.pending[:len(self.pending) - self.max_backlog]
+            self._last_added = time.monotonic()
+            self._dirty = True
+            self._condition.notify()
+
+    def text(self) -> str:
+        """
+        The current summary, followed by any transcriptions not yet compacted into it.
+        """
+        with self._condition:
+            return "\n".join([self.summary, *self.pending]).strip()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="summariser", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread, writing a final snapshot of the summary.
+        """
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self._persist()
+
+    def _compaction_due(self) -> bool:
+        if time.monotonic() < self._retry_after:
+            return False
+        if len(self.pending) >= 2 * self.max_pending:
+            return True
+        return len(self.pending) >= self.max_pending and time.monotonic() - self._last_added >= self.debounce
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopping or self._compaction_due(), timeout=self.debounce)
+                if self._stopping:
+                    return
+                transcriptions = self.pending[:2 * self.max_pending] if self._compaction_due() else []
+                summary = self.summary
+                dropped = self._dropped
+
+            if transcriptions:
+                try:
+                    new_summary = self.summarise(summary, transcriptions)
+                except Exception as e:
+                    print(f"Error updating the summary: {e}. Continuing...")
+                    with self._condition:
+                        self._retry_after = time.monotonic() + self.debounce
+                else:
+                    with self._condition:
+                        self.summary = new_summary
+                        self._dirty = True
+                        # keep anything added while summarising, less any of the batch dropped meanwhile
+                        del self.pending[:max(0, len(transcriptions) - (self._dropped - dropped))]
+
+            if time.monotonic() - self._last_persisted >= self.persist_interval:
+                self._persist()
+
+    def _persist(self):
+        """
+        Write a snapshot of the summary, if it changed since the last one. The snapshot is
+        written to a temporary file and renamed over the previous one, so it is never partial.
+        """
+        with self._condition:
+            if not self._dirty or self.snapshot_path is None:
+                return
+            text = "\n".join([self.summary, *self.pending]).strip()
+            self._dirty = False
+            self._last_persisted = time.monotonic()
+
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as fw:
+            fw.write(text)
+        os.replace(tmp_path, self.snapshot_path)
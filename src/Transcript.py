@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+
+class Utterance:
+    """
+    A single transcribed utterance in the call.
+    """
+
+    __slots__ = ("timestamp", "speaker", "text", "tokens")
+
+    def __init__(self, speaker: str, text: str, tokens: int, timestamp: float | None = None):
+        """
+        :param speaker: Who was speaking, CALLEE or CALLER.
+        :param text: The transcription of the utterance.
+        :param tokens: The number of tokens the utterance takes up in a prompt.
+        :param timestamp: When the utterance was transcribed, defaults to now.
+        """
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.speaker = speaker
+        self.text = text
+        self.tokens = tokens
+
+    def __str__(self):
+        return f"({self.speaker}) - {self.text}"
+
+
+class TranscriptWindow:
+    """
+    The most recent part of the call's transcript, sized by the number of tokens it takes up
+    rather than the number of utterances, so the prompts built from it stay a predictable size.
+
+    When an utterance would take the window over its budget, the oldest utterances are
+    evicted and handed to on_evict, typically to be folded into the summary. Reads return
+    an immutable snapshot that is only rebuilt after the window changes.
+    """
+
+    def __init__(self, token_budget: int = 1000, count_tokens: Callable[[str], int] = lambda text: len(text) // 4,
+                 on_evict: Callable[[Utterance], None] | None = None):
+        """
+        :param token_budget: The maximum number of tokens in the window. The newest utterance
+            is always kept, even if it is over the budget on its own.
+        :param count_tokens: Counts the tokens in a piece of text.
+        :param on_evict: Called with each utterance evicted from the window, oldest first.
+        """
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.on_evict = on_evict
+
+        self._utterances: deque[Utterance] = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+        self._snapshot: tuple[Utterance, ...] | None = ()
+        self._text: str | None = ""
+
+    @property
+    def tokens(self) -> int:
+        """
+        The number of tokens currently in the window.
+        """
+        return self._tokens
+
+    def add(self, speaker: str, text: str) -> Utterance:
+        """
+        Add an utterance to the window, evicting the oldest utterances beyond the token budget.
+
+        :param speaker: Who was speaking, CALLEE or CALLER.
+        :param text: The transcription of the utterance.
+        :return: The utterance that was added.
+        """
+        utterance = Utterance(speaker, text, tokens=0)
+        utterance.tokens = self.count_tokens(str(utterance))
+
+        evicted = []
+        with self._lock:
+            self._utterances.append(utterance)
+            self._tokens += utterance.tokens
+            while self._tokens > self.token_budget and len(self._utterances) > 1:
+                oldest = self._utterances.popleft()
+                self._tokens -= oldest.tokens
+                evicted.append(oldest)
+            self._snapshot = None
+            self._text = None
+
+        if self.on_evict is not None:
+            for oldest in evicted:
+                self.on_evict(oldest)
+        return utterance
+
+    def snapshot(self) -> tuple[Utterance, ...]:
+        """
+        The utterances currently in the window, oldest first. The same tuple is returned until
+        the window changes, so repeated reads are free.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(self._utterances)
+            return self._snapshot
+
+    def text(self) -> str:
+        """
+        The utterances currently in the window as text, one per line, oldest first.
+        """
+        with self._lock:
+            if self._text is None:
+                self._text = "\n".join(str(utterance) for utterance in self._utterances)
+            return self._text
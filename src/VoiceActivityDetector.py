@@ -0,0 +1,203 @@
+import sys
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    """
+    Classifies short frames of audio as speech or non-speech, working on a whole block of
+    frames at a time with NumPy.
+
+    A frame is speech when its energy is well above the background noise floor, which is
+    tracked continuously so that the detector adapts to the volume of the call. Quiet frames
+    with a high zero-crossing rate are treated as noise (hiss, fans) rather than speech.
+    """
+
+    def __init__(self, samplerate, frame_duration=0.02, threshold=0.01, noise_margin=3.0,
+                 max_noise_zcr=0.35, noise_rise=0.02):
+        """
+        :param samplerate: The samplerate of the audio.
+        :param frame_duration: The length of each analysed frame in seconds.
+        :param threshold: The RMS energy below which a frame is never speech.
+        :param noise_margin: How many times louder than the noise floor a frame must be to be speech.
+        :param max_noise_zcr: Frames with a zero-crossing rate above this need twice the energy to be speech.
+        :param noise_rise: The fraction by which the noise floor can rise per block, so that it
+            follows the background getting louder without following the speech.
+        """
+        self.samplerate = samplerate
+        self.frame_length = max(1, int(samplerate * frame_duration))
+        self.threshold = threshold
+        self.noise_margin = noise_margin
+        self.max_noise_zcr = max_noise_zcr
+        self.noise_rise = noise_rise
+        self.noise_floor: float | None = None
+
+    @property
+    def frame_duration(self) -> float:
+        return self.frame_length / self.samplerate
+
+    def features(self, data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the RMS energy and zero-crossing rate of every complete frame in a block.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :return: The energy and zero-crossing rate per frame.
+        """
+        samples = data.mean(axis=1) if data.ndim > 1 else data
+        frame_count = len(samples) // self.frame_length
+        frames = samples[:frame_count * self.frame_length].reshape(frame_count, self.frame_length)
+
+        energy = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / max(1, self.frame_length - 1)
+        return energy, zcr
+
+    def speech_threshold(self) -> float:
+        """
+        The energy a frame currently needs to count as speech.
+        """
+        if self.noise_floor is None:
+            return self.threshold
+        return max(self.threshold, self.noise_floor * self.noise_margin)
+
+    def speech_frames(self, data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Classify every frame in a block, then update the noise floor from the block.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :return: Whether each frame is speech, and the energy of each frame.
+        """
+        energy, zcr = self.features(data)
+        threshold = self.speech_threshold()
+        noisy = zcr > self.max_noise_zcr
+        speech = np.where(noisy, energy > 2 * threshold, energy > threshold)
+
+        if len(energy):
+            # minimum statistics: the floor drops straight to the quietest frame, but only rises slowly
+            quietest = float(energy.min())
+            if self.noise_floor is None or quietest < self.noise_floor:
+                self.noise_floor = quietest
+            else:
+                self.noise_floor = min(quietest, self.noise_floor * (1 + self.noise_rise))
+
+        return speech, energy
+
+    def is_speech(self, data: np.ndarray, min_speech_ratio=0.2) -> bool:
+        """
+        Check whether a block of audio contains speech.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :param min_speech_ratio: The fraction of frames that must be speech.
+        """
+        speech, _ = self.speech_frames(data)
+        return len(speech) > 0 and np.count_nonzero(speech) >= min_speech_ratio * len(speech)
+
+    def segments(self, data: np.ndarray, min_silence=0.3, min_speech=0.1) -> list[tuple[float, float]]:
+        """
+        Find the speech segments in a recording, for checking the detector offline against
+        recordings with known speech boundaries.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :param min_silence: The shortest pause in seconds that separates two segments.
+        :param min_speech: The shortest segment in seconds that is kept.
+        :return: The start and end time of each segment in seconds.
+        """
+        block_length = self.frame_length * max(1, int(0.1 / self.frame_duration))
+        speech = np.concatenate(
+            [self.speech_frames(data[i:i + block_length])[0] for i in range(0, len(data), block_length)]
+        )
+
+        padded = np.concatenate(([False], speech, [False])).astype(np.int8)
+        starts = np.flatnonzero(np.diff(padded) == 1)
+        ends = np.flatnonzero(np.diff(padded) == -1)
+
+        segments: list[list[int]] = []
+        for start, end in zip(starts, ends):
+            if segments and (start - segments[-1][1]) * self.frame_duration < min_silence:
+                segments[-1][1] = end
+            else:
+                segments.append([start, end])
+
+        return [(float(start * self.frame_duration), float(end * self.frame_duration))
+                for start, end in segments if (end - start) * self.frame_duration >= min_speech]
+
+
+class Endpointer:
+    """
+    Decides when an utterance has ended from the blocks of audio recorded since it started.
+
+    Rather than always waiting for a fixed silence, the utterance is closed after only
+    min_silence when the endpoint is clear: enough speech has been heard, the trailing
+    silence is well below the speech threshold, and it is longer than the pauses the
+    speaker has made within the utterance so far. Otherwise it waits for max_silence.
+    """
+
+    def __init__(self, vad: VoiceActivityDetector, min_silence=0.3, max_silence=2.0,
+                 min_speech=0.5, pause_factor=1.5):
+        """
+        :param vad: The detector used to classify the audio.
+        :param min_silence: The shortest silence in seconds that can end an utterance.
+        :param max_silence: The silence in seconds after which an utterance always ends.
+        :param min_speech: The speech in seconds needed before an utterance can end early.
+        :param pause_factor: How much longer than the longest pause within the utterance the
+            trailing silence must be to end it early.
+        """
+        self.vad = vad
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.min_speech = min_speech
+        self.pause_factor = pause_factor
+        self.reset()
+
+    def reset(self):
+        """
+        Start tracking a new utterance.
+        """
+        self.speech_frames = 0
+        self.silent_frames = 0
+        self.longest_pause = 0
+        self.silence_energy = 0.0
+
+    def required_silence(self) -> float:
+        """
+        The trailing silence in seconds currently needed to end the utterance.
+        """
+        frame_duration = self.vad.frame_duration
+        confident = (
+            self.speech_frames * frame_duration >= self.min_speech
+            and self.silence_energy < 0.5 * self.vad.speech_threshold()
+        )
+        if not confident:
+            return self.max_silence
+
+        return min(self.max_silence, max(self.min_silence, self.pause_factor * self.longest_pause * frame_duration))
+
+    def update(self, data: np.ndarray) -> bool:
+        """
+        Add the next block of the utterance.
+
+        :param data: The audio, with shape (samples,) or (samples, channels).
+        :return: Whether the utterance has ended.
+        """
+        speech, energy = self.vad.speech_frames(data)
+        for is_speech, frame_energy in zip(speech.tolist(), energy.tolist()):
+            if is_speech:
+                if self.speech_frames:
+                    self.longest_pause = max(self.longest_pause, self.silent_frames)
+                self.speech_frames += 1
+                self.silent_frames = 0
+                self.silence_energy = 0.0
+            else:
+                self.silent_frames += 1
+                self.silence_energy += (frame_energy - self.silence_energy) / self.silent_frames  # running mean
+
+        return self.silent_frames * self.vad.frame_duration >= self.required_silence()
+
+
+if __name__ == "__main__":
+    import soundfile as sf
+
+    audio, samplerate = sf.read(sys.argv[1], dtype="float32")
+    vad = VoiceActivityDetector(samplerate)
+    for start, end in vad.segments(audio):
+        print(f"{start:.2f}s - {end:.2f}s")